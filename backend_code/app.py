@@ -2,6 +2,9 @@ from imports import *
 from fields import *
 from classes import *
 from servicenow import *
+from metrics import *
+from resilience import *
+from scheduler import *
 
 
 load_dotenv()
@@ -27,34 +30,146 @@ def get_llm_model():
     )
 
 auth_config = AuthConfig(
-    client_id="",
-    client_secret="",
-    username="",
-    password="",
-    instance_url=""
+    client_id=os.getenv("SERVICENOW_CLIENT_ID", ""),
+    client_secret=os.getenv("SERVICENOW_CLIENT_SECRET", ""),
+    username=os.getenv("SERVICENOW_USERNAME", ""),
+    password=os.getenv("SERVICENOW_PASSWORD", ""),
+    instance_url=os.getenv("SERVICENOW_INSTANCE_URL", "")
 )
 
 llm_model = get_llm_model()
-auth_manager = AuthManager(auth_config)
-servicenow_api = ServiceNowAPI(auth_manager, llm_model)
+shared_state = create_state_backend()
+auth_manager = AuthManager(auth_config, shared_state)
+servicenow_api = ServiceNowAPI(auth_manager, llm_model, shared_state)
+register_stats("servicenow", servicenow_api.cache_stats)
+
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    """Give every request an ID (honouring X-Request-ID) that is carried into api_calls and timings"""
+    request_id = start_request(request.headers.get("X-Request-ID"))
+    response = await call_next(request)
+    response.headers["X-Request-ID"] = request_id
+    return response
 
 @app.post("/query")
 async def process_query(query: Query):
     """Process natural language query and return ServiceNow data in human-readable format"""
+    set_priority_class("interactive")
+    start_deadline(query.timeout_seconds)
     try:
-        result = servicenow_api.process_query(query.question, query.format_response)
+        with stage_timer("total"):
+            result = await servicenow_api.process_query(query.question, query.format_response, query.bypass_cache, query.session_id)
+        if query.include_timings:
+            result["timings"] = get_timings()
         return result
     except HTTPException as e:
         raise e
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
 
 @app.post("/query/raw")
 async def process_query_raw(query: Query):
-    """Process natural language query and return raw ServiceNow data (JSON format)"""
+    """Process natural language query and return raw ServiceNow data (JSON format, or NDJSON when streaming)"""
+    if query.stream:
+        set_priority_class("export")
+        # Exports can run long, so only an explicit timeout_seconds bounds them
+        if query.timeout_seconds is not None:
+            start_deadline(query.timeout_seconds)
+        # Parse before the response starts, so a shed request is still a 503 with Retry-After
+        # and a request whose deadline ran out is a 504 rather than an empty 200
+        try:
+            parsed = await servicenow_api.parse_query(query.question)
+        except DeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
+
+        async def record_stream():
+            async for record in servicenow_api.stream_query_records(query.question, parsed):
+                yield json.dumps(record, default=str) + "\n"
+
+        return StreamingResponse(record_stream(), media_type="application/x-ndjson")
+
+    set_priority_class("export")
+    start_deadline(query.timeout_seconds)
     try:
-        result = servicenow_api.process_query(query.question, format_response=False)
+        with stage_timer("total"):
+            result = await servicenow_api.process_query(
+                query.question, format_response=False, bypass_cache=query.bypass_cache, session_id=query.session_id
+            )
+        if query.include_timings:
+            result["timings"] = get_timings()
         return result
     except HTTPException as e:
         raise e
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+@app.post("/query/batch")
+async def process_query_batch(queries: List[Query], max_concurrency: Optional[int] = None):
+    """Process a list of queries concurrently, returning per-item results and errors in input order"""
+    # Every item is a task, and the batch keeps its ServiceNow responses until it ends
+    max_items = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+    if len(queries) > max_items:
+        raise HTTPException(status_code=413, detail=f"Batch has {len(queries)} queries, the limit is {max_items}")
+    set_priority_class("batch")
+    limit = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+    if max_concurrency is not None:
+        limit = max(1, min(max_concurrency, int(os.getenv("BATCH_MAX_CONCURRENCY_LIMIT", "32"))))
+    return await servicenow_api.process_batch(queries, limit)
+
+def _sse_event(event: str, data: Any) -> str:
+    """Encode one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.post("/query/stream")
+async def process_query_stream(query: Query):
+    """Process natural language query and stream raw data, then the formatted answer token by token (SSE)"""
+    set_priority_class("interactive")
+    start_deadline(query.timeout_seconds)
+    # Parse and fetch before the response starts, so a shed request is a 503 with Retry-After and an expired one a 504
+    try:
+        response_data = await servicenow_api.fetch_query_results(query.question, query.bypass_cache, query.session_id)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+    async def event_stream():
+        async for event in servicenow_api.stream_query(query.question, query.bypass_cache, query.session_id, response_data):
+            if event["event"] == "done" and query.include_timings:
+                event["data"]["timings"] = get_timings()
+            yield _sse_event(event["event"], event["data"])
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.on_event("startup")
+async def startup():
+    """Fetch the ServiceNow token up front, keep it and the local replica refreshed, and load the token encoding in the background"""
+    if os.getenv("TOKEN_BACKGROUND_REFRESH", "true").lower() == "true":
+        auth_manager.start_background_refresh()
+    servicenow_api.start_replica_sync()
+    # Loading the tiktoken encoding can mean a download, so keep it off the event loop; counts are estimated until it lands
+    asyncio.get_running_loop().run_in_executor(None, load_token_encoding)
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Stop replica sync, release pooled ServiceNow connections and close the shared state backend"""
+    await servicenow_api.aclose()
+    await auth_manager.aclose()
+    shared_state.close()
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Cache hit/miss counters"""
+    return servicenow_api.cache_stats()
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: stage latencies, LLM tokens, ServiceNow calls and cache counters"""
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -66,10 +181,12 @@ if __name__ == "__main__":
     
     host = os.getenv("API_HOST", "0.0.0.0")
     port = int(os.getenv("API_PORT", "7000"))
+    # With more than one worker, set SHARED_STATE_BACKEND=sqlite so workers share the token, caches and rate limit
+    workers = int(os.getenv("API_WORKERS", "1"))
     
     uvicorn.run(
-        app,
+        "app:app" if workers > 1 else app,
         host=host,
         port=port,
-
-    )
\ No newline at end of file
+        workers=workers
+    )
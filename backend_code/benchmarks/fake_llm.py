@@ -0,0 +1,99 @@
+"""Deterministic stand-in for AzureChatOpenAI: canned parses and formatter output with simulated delay."""
+import asyncio
+import json
+import re
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+INCIDENT_PARSE = {
+    "query_type": "incident",
+    "incident_query": {
+        "sysparm_query": "active=true^ORDERBYDESCopened_at",
+        "sysparm_fields": "number,short_description,state,priority",
+        "sysparm_limit": 50,
+        "sysparm_display_value": "true"
+    },
+    "problem_query": {},
+    "explanation": "Canned incident parse from the benchmark fake LLM"
+}
+
+PROBLEM_PARSE = {
+    "query_type": "problem",
+    "incident_query": {},
+    "problem_query": {
+        "sysparm_query": "active=true",
+        "sysparm_fields": "number,short_description,state,priority",
+        "sysparm_display_value": "true"
+    },
+    "explanation": "Canned problem parse from the benchmark fake LLM"
+}
+
+
+class FakeAzureChatOpenAI(BaseChatModel):
+    """Returns a canned JSON parse for parser prompts and a canned summary for formatter prompts"""
+
+    parse_delay_ms: float = 800.0
+    format_delay_ms: float = 1500.0
+    tokens_per_second: float = 80.0
+    calls: Dict[str, int] = {}
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-azure-chat-openai"
+
+    def _is_parser_prompt(self, text: str) -> bool:
+        return "Respond with a JSON structure" in text
+
+    def _reply(self, text: str) -> str:
+        if self._is_parser_prompt(text):
+            question = re.search(r"Question: (.*)", text)
+            question = question.group(1).lower() if question else ""
+            return json.dumps(PROBLEM_PARSE if "problem" in question else INCIDENT_PARSE)
+        count = re.search(r"total_results: (\d+)", text)
+        return (
+            f"Based on your query, I found {count.group(1) if count else 'some'} records. "
+            "Here are the most important ones, ordered by priority. "
+            "Summary: the benchmark fake LLM produced this response."
+        )
+
+    def _usage(self, text: str, reply: str) -> Dict[str, int]:
+        prompt_tokens = len(text) // 4
+        completion_tokens = len(reply) // 4
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        text = messages[-1].content
+        reply = self._reply(text)
+        stage = "parse" if self._is_parser_prompt(text) else "format"
+        self.calls[stage] = self.calls.get(stage, 0) + 1
+        usage = self._usage(text, reply)
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=reply))],
+            llm_output={"token_usage": usage}
+        )
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        text = messages[-1].content
+        await asyncio.sleep((self.parse_delay_ms if self._is_parser_prompt(text) else self.format_delay_ms) / 1000)
+        return self._generate(messages, stop, run_manager, **kwargs)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        text = messages[-1].content
+        reply = self._reply(text)
+        self.calls["format_stream"] = self.calls.get("format_stream", 0) + 1
+        # Time to first token, then a steady token rate
+        await asyncio.sleep(self.parse_delay_ms / 4000)
+        words = reply.split(" ")
+        for index, word in enumerate(words):
+            await asyncio.sleep(1 / self.tokens_per_second)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word + (" " if index < len(words) - 1 else "")))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
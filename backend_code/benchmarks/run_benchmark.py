@@ -0,0 +1,177 @@
+"""Offline load benchmark for the ServiceNow natural language API.
+
+Starts the ServiceNow stub on a local port, points the app at it with a fake LLM,
+and drives load scenarios in-process, reporting p50/p95/p99 latency and throughput.
+
+    cd backend_code
+    python -m benchmarks.run_benchmark --scenario all --requests 200 --concurrency 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from typing import Dict, List
+
+import httpx
+import uvicorn
+
+from benchmarks.fake_llm import FakeAzureChatOpenAI
+from benchmarks.stub_servicenow import StubConfig, create_stub_app
+
+SCENARIOS = {
+    # LLM parse, ServiceNow fetch, LLM format
+    "query": ("/query", "Which incidents are affecting payroll users right now"),
+    # Rule-based parse, small result set rendered by the template formatter
+    "template": ("/query", "Show me the top 5 open P1 incidents"),
+    # Rule-based parse, no formatter
+    "raw": ("/query/raw", "Show me all open P1 incidents"),
+    # Problem search plus batched related-incident lookups
+    "problem": ("/query/raw", "Which problems are behind the recurring failures and their incidents"),
+    # Rule-based parse to an Aggregate API call
+    "aggregate": ("/query/raw", "How many open incidents per assignment group"),
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_stub(config: StubConfig) -> str:
+    """Run the ServiceNow stub in a background thread and return its base URL"""
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(create_stub_app(config), host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+def load_app(instance_url: str, fake_llm: FakeAzureChatOpenAI):
+    """Import the app configured against the stub, with the fake LLM swapped in"""
+    os.environ.update({
+        "SERVICENOW_INSTANCE_URL": instance_url,
+        "SERVICENOW_CLIENT_ID": "benchmark",
+        "SERVICENOW_CLIENT_SECRET": "benchmark",
+        "SERVICENOW_USERNAME": "benchmark",
+        "SERVICENOW_PASSWORD": "benchmark",
+        "AZURE_OPENAI_ENGINE": "benchmark",
+        "AZURE_OPENAI_MODEL": "gpt-4o",
+        "AZURE_OPENAI_TEMPERATURE": "0.0",
+        "AZURE_OPENAI_ENDPOINT": "https://benchmark.openai.azure.com",
+        "AZURE_OPENAI_API_KEY": "benchmark",
+        "AZURE_OPENAI_API_VERSION": "2024-02-01",
+    })
+    import app as app_module
+    app_module.servicenow_api.llm = fake_llm
+    return app_module
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def run_scenario(client: httpx.AsyncClient, name: str, requests: int, concurrency: int, cold: bool) -> Dict:
+    path, question = SCENARIOS[name]
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(index: int):
+        nonlocal errors
+        # Cold runs make every question unique so parse and result caches never hit
+        body = {"question": f"{question} {index}" if cold else question, "bypass_cache": cold}
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.post(path, json=body)
+                data = response.json()
+                if response.status_code != 200 or "error" in data.get("raw_data", data):
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(index) for index in range(requests)])
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.50), 1),
+        "p95_ms": round(percentile(latencies, 0.95), 1),
+        "p99_ms": round(percentile(latencies, 0.99), 1),
+        "max_ms": round(latencies[-1], 1) if latencies else 0.0,
+        "rps": round(requests / elapsed, 1) if elapsed else 0.0
+    }
+
+
+async def main(args) -> List[Dict]:
+    stub_config = StubConfig(
+        incidents=args.incidents,
+        problems=args.problems,
+        related_per_problem=args.related_per_problem,
+        latency_ms=args.servicenow_latency_ms,
+        jitter_ms=args.servicenow_jitter_ms
+    )
+    fake_llm = FakeAzureChatOpenAI(parse_delay_ms=args.llm_parse_ms, format_delay_ms=args.llm_format_ms)
+
+    if args.target:
+        transport, base_url = None, args.target
+    else:
+        app_module = load_app(start_stub(stub_config), fake_llm)
+        transport, base_url = httpx.ASGITransport(app=app_module.app), "http://benchmark"
+
+    scenarios = list(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    reports = []
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=args.timeout) as client:
+        # Warm up the token and connection pool so the first scenario isn't penalised
+        await client.post("/query/raw", json={"question": SCENARIOS["raw"][1]})
+        for name in scenarios:
+            reports.append(await run_scenario(client, name, args.requests, args.concurrency, args.cold))
+    return reports
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=["all", *SCENARIOS], default="all")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--cold", action="store_true", help="unique questions and cache bypass on every request")
+    parser.add_argument("--incidents", type=int, default=2000)
+    parser.add_argument("--problems", type=int, default=100)
+    parser.add_argument("--related-per-problem", type=int, default=10)
+    parser.add_argument("--servicenow-latency-ms", type=float, default=50.0)
+    parser.add_argument("--servicenow-jitter-ms", type=float, default=10.0)
+    parser.add_argument("--llm-parse-ms", type=float, default=800.0)
+    parser.add_argument("--llm-format-ms", type=float, default=1500.0)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--target", help="benchmark an already running server instead of the in-process app")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    reports = asyncio.run(main(args))
+    if args.json:
+        json.dump(reports, sys.stdout, indent=2)
+        print()
+    else:
+        columns = ["scenario", "requests", "concurrency", "errors", "p50_ms", "p95_ms", "p99_ms", "max_ms", "rps"]
+        print("  ".join(f"{column:>11}" for column in columns))
+        for report in reports:
+            print("  ".join(f"{str(report[column]):>11}" for column in columns))
@@ -0,0 +1,179 @@
+"""Local ServiceNow stub for benchmarks: OAuth token, incident/problem Table API and Aggregate API with simulated latency."""
+import asyncio
+import random
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+class StubConfig:
+    def __init__(self, incidents: int = 2000, problems: int = 100, related_per_problem: int = 10,
+                 latency_ms: float = 50.0, jitter_ms: float = 10.0, token_latency_ms: float = 150.0,
+                 token_expires_in: int = 1800, seed: int = 7):
+        self.incidents = incidents
+        self.problems = problems
+        self.related_per_problem = related_per_problem
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.token_latency_ms = token_latency_ms
+        self.token_expires_in = token_expires_in
+        self.seed = seed
+
+
+STATES = ["1", "2", "3", "6", "7"]
+GROUPS = ["Network", "Database", "Service Desk", "Hardware", "Software"]
+
+
+def build_dataset(config: StubConfig) -> Dict[str, List[Dict]]:
+    """Deterministic incident/problem records; the first problems * related_per_problem incidents link to problems"""
+    rng = random.Random(config.seed)
+    problems = []
+    for index in range(config.problems):
+        problems.append({
+            "sys_id": f"prb{index:032d}"[-32:],
+            "number": f"PRB{index:07d}",
+            "short_description": f"Recurring failure {index}",
+            "state": rng.choice(["101", "102", "103", "104", "106", "107"]),
+            "priority": str(rng.randint(1, 5)),
+            "active": "true",
+            "opened_by": "System Administrator",
+            "opened": "2026-01-01 08:00:00",
+            "sys_updated_on": f"2026-01-01 08:{index // 60 % 60:02d}:{index % 60:02d}"
+        })
+
+    incidents = []
+    for index in range(config.incidents):
+        problem = None
+        if problems and index < config.problems * config.related_per_problem:
+            problem = problems[index % config.problems]
+        state = rng.choice(STATES)
+        incidents.append({
+            "sys_id": f"inc{index:032d}"[-32:],
+            "number": f"INC{index:07d}",
+            "short_description": f"User reported issue {index}",
+            "state": state,
+            "active": "true" if state in ("1", "2", "3") else "false",
+            "priority": str(rng.randint(1, 5)),
+            "assignment_group": rng.choice(GROUPS),
+            "assigned_to": rng.choice(["Beth Anglin", "David Loo", "Fred Luddy", ""]),
+            "opened_by": "System Administrator",
+            "opened": "2026-01-02 09:00:00",
+            "problem_id": problem["sys_id"] if problem else "",
+            "sys_updated_on": f"2026-01-02 09:{index // 60 % 60:02d}:{index % 60:02d}"
+        })
+    return {"incident": incidents, "problem": problems}
+
+
+def _matches(record: Dict, condition: str) -> bool:
+    """Tiny encoded-query matcher covering the operators the service sends"""
+    if not condition or condition.startswith("ORDERBY"):
+        return True
+    for operator in ("NOT IN", "IN", "!=", ">=", "<=", "="):
+        field, sep, value = condition.partition(operator)
+        if sep and field and field.replace("_", "").replace(".", "").isalnum():
+            field = field.split(".")[0]
+            if field not in record:
+                return True
+            actual = record.get(field, "")
+            if operator == "IN":
+                return actual in value.split(",")
+            if operator == "NOT IN":
+                return actual not in value.split(",")
+            if operator == "=":
+                return value.startswith("javascript:") or actual == value
+            if operator == "!=":
+                return actual != value
+            return True
+    return True
+
+
+def create_stub_app(config: Optional[StubConfig] = None) -> FastAPI:
+    config = config or StubConfig()
+    data = build_dataset(config)
+    problem_numbers = {problem["sys_id"]: problem["number"] for problem in data["problem"]}
+    app = FastAPI(title="ServiceNow stub")
+    app.state.requests = {"oauth": 0, "incident": 0, "problem": 0, "stats": 0}
+
+    async def delay(base_ms: float):
+        await asyncio.sleep(max(0.0, base_ms + random.uniform(-config.jitter_ms, config.jitter_ms)) / 1000)
+
+    @app.post("/oauth_token.do")
+    async def oauth_token():
+        app.state.requests["oauth"] += 1
+        await delay(config.token_latency_ms)
+        return {
+            "access_token": f"stub-token-{app.state.requests['oauth']}",
+            "refresh_token": "stub-refresh",
+            "expires_in": config.token_expires_in,
+            "token_type": "Bearer"
+        }
+
+    @app.get("/api/now/v2/table/{table}")
+    async def table_api(table: str, request: Request):
+        if table not in data:
+            return JSONResponse({"error": {"message": "Invalid table"}}, status_code=400)
+        app.state.requests[table] += 1
+        await delay(config.latency_ms)
+
+        params = request.query_params
+        query = params.get("sysparm_query", "")
+        # OR-groups (^NQ / ^OR) are treated as AND here; the stub only needs plausible volumes
+        conditions = [part for part in query.replace("^NQ", "^").replace("^OR", "^").split("^") if part]
+        records = [record for record in data[table] if all(_matches(record, condition) for condition in conditions)]
+
+        offset = int(params.get("sysparm_offset") or 0)
+        limit = int(params.get("sysparm_limit") or 10000)
+        page = records[offset:offset + limit]
+        fields = [field for field in params.get("sysparm_fields", "").split(",") if field]
+        display = params.get("sysparm_display_value") == "true"
+
+        result = []
+        for record in page:
+            row = {field: record.get(field, "") for field in fields} if fields else dict(record)
+            if display and row.get("problem_id"):
+                row["problem_id"] = problem_numbers.get(row["problem_id"], row["problem_id"])
+            result.append(row)
+
+        headers = {"X-Total-Count": str(len(records))}
+        if offset + limit < len(records):
+            headers["Link"] = f'<{request.url.path}?sysparm_offset={offset + limit}>;rel="next"'
+        return JSONResponse({"result": result}, headers=headers)
+
+    @app.get("/api/now/stats/{table}")
+    async def stats_api(table: str, request: Request):
+        if table not in data:
+            return JSONResponse({"error": {"message": "Invalid table"}}, status_code=400)
+        app.state.requests["stats"] += 1
+        await delay(config.latency_ms)
+
+        params = request.query_params
+        query = params.get("sysparm_query", "")
+        conditions = [part for part in query.replace("^NQ", "^").replace("^OR", "^").split("^") if part]
+        records = [record for record in data[table] if all(_matches(record, condition) for condition in conditions)]
+
+        group_by = [field for field in params.get("sysparm_group_by", "").split(",") if field]
+        groups: Dict[tuple, List[Dict]] = {}
+        for record in records:
+            groups.setdefault(tuple(record.get(field, "") for field in group_by), []).append(record)
+
+        def stats(rows: List[Dict]) -> Dict:
+            result = {"count": str(len(rows))}
+            for stat, combine in (("avg", lambda values: sum(values) / len(values)), ("min", min), ("max", max), ("sum", sum)):
+                fields = [field for field in params.get(f"sysparm_{stat}_fields", "").split(",") if field]
+                values = {}
+                for field in fields:
+                    numbers = [float(row[field]) for row in rows if str(row.get(field, "")).replace(".", "").isdigit()]
+                    values[field] = str(round(combine(numbers), 4)) if numbers else ""
+                if values:
+                    result[stat] = values
+            return result
+
+        if not group_by:
+            return {"result": {"stats": stats(records)}}
+        return {"result": [
+            {"stats": stats(rows), "groupby_fields": [{"field": field, "value": value} for field, value in zip(group_by, key)]}
+            for key, rows in sorted(groups.items())
+        ]}
+
+    return app
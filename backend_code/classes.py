@@ -1,4 +1,7 @@
 from imports import *
+from metrics import *
+from resilience import *
+from shared_state import *
 class AuthConfig(BaseModel):
     client_id: str
     client_secret: str
@@ -23,6 +26,11 @@ class TokenInfo(BaseModel):
 class Query(BaseModel):
     question: str
     format_response: bool = True  # New field to control response formatting
+    bypass_cache: bool = False  # Skip the ServiceNow result cache for fresh data
+    stream: bool = False  # Stream /query/raw records as NDJSON while pages arrive
+    include_timings: bool = False  # Add per-stage latency and LLM token usage to the response
+    timeout_seconds: Optional[float] = None  # End-to-end deadline; defaults to REQUEST_DEADLINE_SECONDS
+    session_id: Optional[str] = None  # Conversation ID; follow-ups about "those" results are refined locally
 
     @field_validator('question')
     def validate_question(cls, v):
@@ -30,59 +38,217 @@ class Query(BaseModel):
             raise ValueError('question cannot be empty')
         return v.strip()
 
+    @field_validator('session_id')
+    def validate_session_id(cls, v):
+        if v is not None and not re.fullmatch(r"[\w.:-]{1,128}", v):
+            raise ValueError('session_id must be 1-128 letters, digits or ._:- characters')
+        return v
+
+    @field_validator('timeout_seconds')
+    def validate_timeout_seconds(cls, v):
+        if v is not None and v <= 0:
+            raise ValueError('timeout_seconds must be positive')
+        return v
+
 class AuthManager:
-    def __init__(self, auth_config: AuthConfig):
+    def __init__(self, auth_config: AuthConfig, state_backend=None):
         self.auth_config = auth_config
+        # Where the token is shared with other workers; the local backend shares nothing
+        self.state = state_backend or LocalStateBackend()
         self.token_info: Optional[TokenInfo] = None
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.refresh_ahead_seconds = float(os.getenv("TOKEN_REFRESH_AHEAD_SECONDS", "300"))
+        self.token_requests = 0
+        self.token_timeout_seconds = float(os.getenv("TOKEN_TIMEOUT_SECONDS", "10"))
+        # One breaker per instance: token and table calls fail fast together when it is down
+        self.circuit_breaker = CircuitBreaker(
+            failure_threshold=int(os.getenv("CIRCUIT_BREAKER_FAILURES", "5")),
+            reset_timeout=float(os.getenv("CIRCUIT_BREAKER_RESET_SECONDS", "30"))
+        )
+
+    def get_http_client(self) -> httpx.AsyncClient:
+        """Get the pooled keep-alive HTTP client shared by all ServiceNow calls"""
+        if self._http_client is None or self._http_client.is_closed:
+            self._http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=int(os.getenv("SERVICENOW_MAX_CONNECTIONS", "100")),
+                    max_keepalive_connections=int(os.getenv("SERVICENOW_MAX_KEEPALIVE", "20")),
+                    keepalive_expiry=float(os.getenv("SERVICENOW_KEEPALIVE_EXPIRY", "30"))
+                )
+            )
+        return self._http_client
+
+    async def aclose(self):
+        """Stop background token refresh and close the pooled HTTP client"""
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
         
-    def _request_token(self) -> TokenInfo:
-        """Request a new token from ServiceNow"""
+    async def _request_token(self, refresh_token: Optional[str] = None) -> TokenInfo:
+        """Request a new token from ServiceNow, using the refresh_token grant when a refresh token is given"""
         oauth_url = f"{self.auth_config.instance_url}/oauth_token.do"
         auth_data = {
             "client_id": self.auth_config.client_id,
-            "client_secret": self.auth_config.client_secret,
-            "username": self.auth_config.username,
-            "password": self.auth_config.password,
-            "grant_type": self.auth_config.grant_type
+            "client_secret": self.auth_config.client_secret
         }
+        if refresh_token:
+            auth_data.update({
+                "grant_type": "refresh_token",
+                "refresh_token": refresh_token
+            })
+        else:
+            auth_data.update({
+                "username": self.auth_config.username,
+                "password": self.auth_config.password,
+                "grant_type": self.auth_config.grant_type
+            })
         
         try:
-            response = requests.post(oauth_url, data=auth_data)
+            self.circuit_breaker.allow()
+        except CircuitOpenError as e:
+            OAUTH_REQUESTS.labels(grant_type=auth_data["grant_type"], status="circuit_open").inc()
+            raise HTTPException(status_code=503, detail=str(e))
+        
+        try:
+            self.token_requests += 1
+            with stage_timer("oauth_token"):
+                timeout = call_timeout(self.token_timeout_seconds)
+                try:
+                    response = await asyncio.wait_for(
+                        self.get_http_client().post(oauth_url, data=auth_data, timeout=timeout),
+                        timeout=timeout
+                    )
+                except asyncio.TimeoutError:
+                    raise httpx.ReadTimeout(f"Token request timed out after {timeout:.1f}s")
+            if response.status_code >= 500:
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
             response.raise_for_status()
             token_data = response.json()
+            OAUTH_REQUESTS.labels(grant_type=auth_data["grant_type"], status="ok").inc()
             
             return TokenInfo(
                 access_token=token_data["access_token"],
-                refresh_token=token_data["refresh_token"],
+                # Refresh responses may not rotate the refresh token
+                refresh_token=token_data.get("refresh_token") or refresh_token or "",
                 expires_in=token_data["expires_in"],
                 token_type=token_data["token_type"],
                 created_at=time.time()
             )
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
+            if isinstance(e, httpx.TransportError):
+                self.circuit_breaker.record_failure()
+            OAUTH_REQUESTS.labels(grant_type=auth_data["grant_type"], status="error").inc()
             raise HTTPException(
                 status_code=500,
                 detail=f"Failed to obtain access token: {str(e)}"
             )
 
+    def _seconds_until_expiry(self) -> float:
+        """Seconds left before the current token expires"""
+        if not self.token_info:
+            return 0.0
+        return self.token_info.created_at + self.token_info.expires_in - time.time()
+
     def _is_token_expired(self) -> bool:
         """Check if the current token is expired"""
+        return self._seconds_until_expiry() <= 60
+
+    def _refresh_ahead(self) -> float:
+        """How long before expiry a token is proactively replaced"""
         if not self.token_info:
-            return True
-        
-        current_time = time.time()
-        expiration_time = self.token_info.created_at + self.token_info.expires_in - 60
-        return current_time >= expiration_time
+            return self.refresh_ahead_seconds
+        return min(self.refresh_ahead_seconds, self.token_info.expires_in / 2)
+
+    def _shared_token_key(self) -> str:
+        return f"{self.auth_config.instance_url}|{self.auth_config.client_id}|{self.auth_config.username}"
+
+    async def _adopt_shared_token(self, min_seconds_left: float) -> bool:
+        """Use a token another worker already obtained if it stays valid for at least min_seconds_left"""
+        shared = await self.state.get("oauth_token", self._shared_token_key())
+        if not shared:
+            return False
+        token_info = TokenInfo(**shared)
+        if token_info.created_at + token_info.expires_in - time.time() <= min_seconds_left:
+            return False
+        self.token_info = token_info
+        return True
+
+    async def _obtain_token(self):
+        """Request a token, preferring the refresh grant, and publish it to the other workers"""
+        token_info = None
+        if self.token_info and self.token_info.refresh_token:
+            try:
+                token_info = await self._request_token(self.token_info.refresh_token)
+            except HTTPException as e:
+                print(f"Refresh token grant failed, falling back to password grant: {e.detail}")
+        self.token_info = token_info or await self._request_token()
+        await self.state.set(
+            "oauth_token", self._shared_token_key(), self.token_info.model_dump(), ttl=self.token_info.expires_in
+        )
+
+    async def refresh_token(self, force: bool = False) -> TokenInfo:
+        """Refresh the token once for all concurrent callers; later callers reuse the in-flight result.
+
+        Across workers, one holds the shared lock and logs in while the others adopt its token.
+        """
+        async with self._refresh_lock:
+            if not force and not self._is_token_expired():
+                return self.token_info
+
+            # A forced refresh wants a token newer than the one about to expire
+            min_seconds_left = self._refresh_ahead() if force else 60
+            if await self._adopt_shared_token(min_seconds_left):
+                return self.token_info
+
+            try:
+                async with self.state.lock(f"oauth_token:{self._shared_token_key()}", timeout=self.token_timeout_seconds + 5):
+                    if not await self._adopt_shared_token(min_seconds_left):
+                        await self._obtain_token()
+            except LockTimeout:
+                # The holder is stuck; log in ourselves rather than fail the request
+                await self._obtain_token()
+            return self.token_info
     
-    def get_valid_token(self) -> str:
+    async def get_valid_token(self) -> str:
         """Get a valid access token, requesting a new one if necessary"""
         if self._is_token_expired():
-            self.token_info = self._request_token()
+            await self.refresh_token()
         
         return self.token_info.access_token
 
-    def _get_headers(self) -> Dict[str, str]:
+    def start_background_refresh(self):
+        """Keep the token fresh ahead of expiry so user requests never wait on OAuth"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._background_refresh_loop())
+
+    async def _background_refresh_loop(self):
+        while True:
+            try:
+                if self.token_info is None:
+                    await self.refresh_token()
+                else:
+                    await asyncio.sleep(max(self._seconds_until_expiry() - self._refresh_ahead(), 0))
+                    await self.refresh_token(force=True)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Background token refresh failed: {str(e)}")
+                await asyncio.sleep(float(os.getenv("TOKEN_REFRESH_RETRY_SECONDS", "30")))
+
+    async def _get_headers(self) -> Dict[str, str]:
         """Get current headers with valid access token"""
-        access_token = self.get_valid_token()
+        access_token = await self.get_valid_token()
         return {
             "Accept": "application/json",
             "Content-Type": "application/json",
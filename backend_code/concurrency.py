@@ -0,0 +1,66 @@
+from imports import *
+
+
+class SingleFlight:
+    """Run at most one call per key at a time; concurrent callers with the same key share its result"""
+
+    def __init__(self):
+        self._inflight: Dict[str, Dict[str, Any]] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn) -> Tuple[Any, bool]:
+        """Await fn() once per in-flight key. Returns (result, shared).
+
+        fn() runs in its own task, so a caller that is cancelled only stops waiting; the work is
+        cancelled once nobody is left waiting for it, and later callers start it again.
+        """
+        entry = self._inflight.get(key)
+        if entry is None:
+            task = asyncio.ensure_future(fn())
+            entry = {"task": task, "waiters": 0, "followers": 0}
+            self._inflight[key] = entry
+            task.add_done_callback(lambda done: self._finish(key, entry))
+            self.executed += 1
+            leader = True
+        else:
+            entry["followers"] += 1
+            self.coalesced += 1
+            leader = False
+
+        task = entry["task"]
+        entry["waiters"] += 1
+        try:
+            result = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task.cancelled():
+                # The shared call was cancelled, not this caller: run it again
+                return await self.do(key, fn)
+            raise
+        finally:
+            entry["waiters"] -= 1
+            if not entry["waiters"] and not task.done():
+                # Nobody is left waiting for the result
+                if self._inflight.get(key) is entry:
+                    del self._inflight[key]
+                task.cancel()
+
+        if leader and not entry["followers"]:
+            return result, False
+        # Callers mutate their results, so each caller gets its own copy once the result is shared
+        return copy.deepcopy(result), True
+
+    def _finish(self, key: str, entry: Dict[str, Any]):
+        if self._inflight.get(key) is entry:
+            del self._inflight[key]
+        # Mark the outcome as retrieved even when every caller has gone
+        if not entry["task"].cancelled():
+            entry["task"].exception()
+
+    def stats(self) -> Dict[str, int]:
+        """Executed vs coalesced call counts"""
+        return {
+            "in_flight": len(self._inflight),
+            "executed": self.executed,
+            "coalesced": self.coalesced
+        }
@@ -0,0 +1,263 @@
+from imports import *
+from fields import *
+
+INCIDENT_STATES = {
+    "new": "1",
+    "in progress": "2",
+    "on hold": "3",
+    "resolved": "6",
+    "closed": "7",
+    "cancelled": "8",
+    "canceled": "8"
+}
+
+PROBLEM_STATES = {
+    "new": "101",
+    "assess": "102",
+    "root cause analysis": "103",
+    "fix in progress": "104",
+    "in progress": "104",
+    "resolved": "106",
+    "closed": "107"
+}
+
+PRIORITY_LABELS = {
+    "critical": "1",
+    "high": "2",
+    "moderate": "3",
+    "medium": "3",
+    "low": "4",
+    "planning": "5"
+}
+
+# Words that carry no filter meaning in the questions users ask
+FILLER_WORDS = {
+    "show", "me", "all", "the", "list", "get", "find", "give", "display", "what", "which", "are", "is",
+    "there", "any", "a", "an", "of", "with", "that", "have", "has", "been", "were", "was", "please",
+    "can", "you", "i", "see", "want", "to", "in", "for", "and", "or", "currently", "current", "status",
+    "state", "priority", "priorities", "tickets", "ticket", "incidents", "incident", "problems",
+    "problem", "records", "items", "by", "on", "from", "who", "at"
+}
+
+# Group-by phrases for counting questions ("how many incidents per assignment group")
+GROUP_BY_FIELDS = {
+    "assignment group": "assignment_group",
+    "group": "assignment_group",
+    "team": "assignment_group",
+    "assignee": "assigned_to",
+    "assigned to": "assigned_to",
+    "priority": "priority",
+    "state": "state",
+    "status": "state"
+}
+
+# Negations the rule parser can't express; any of them sends the question to the LLM
+NEGATION_PATTERN = re.compile(r"\b(not|no|never|cannot|except|excluding|exclude|without|other than|\w+n t)\b|\bnon-?")
+
+# Fields the rule parser has no filter for; "high impact" must not be read as high priority
+UNSUPPORTED_FIELD_PATTERN = re.compile(
+    r"\b(impact|urgency|urgent|severity|category|subcategory|caller|location|sla|breach\w*|configuration item|cmdb|"
+    r"escalat\w*|reassign\w*|reopen\w*|vip)\b"
+)
+
+# Date field a time window applies to once a question names a terminal state ("closed in the last 7 days")
+STATE_TIME_FIELDS = {"resolved": "resolved_at", "closed": "closed_at"}
+
+RETURN_FIELDS = ["number", "short_description", "description", "state", "priority", "opened_by", "opened", "assigned_to", "assignment_group"]
+INCIDENT_RETURN_FIELDS = [field for field in RETURN_FIELDS if field in INCIDENT_FIELDS]
+PROBLEM_RETURN_FIELDS = [field for field in RETURN_FIELDS if field in PROBLEM_FIELDS]
+
+
+class FastQueryParser:
+    """Deterministic parser for simple filter questions, producing the same structure as the LLM parser.
+
+    Any word that is neither matched nor filler may be a filter the parser would drop, so by default
+    (min_confidence 1.0) such questions go to the LLM.
+    """
+
+    def __init__(self, min_confidence: float = 1.0):
+        self.min_confidence = min_confidence
+
+    def parse(self, question: str) -> Optional[Tuple[Dict, float]]:
+        """Return (parsed_query, confidence), or None when the question needs the LLM"""
+        text = " ".join(re.sub(r"[^\w\s-]", " ", question.lower()).split())
+        mentions_incidents = re.search(r"\b(incidents?|tickets?)\b", text) is not None
+        mentions_problems = re.search(r"\bproblems?\b", text) is not None
+        if mentions_incidents and mentions_problems:
+            # Combined questions need the LLM to relate the two tables
+            return None
+        if NEGATION_PATTERN.search(text):
+            # "not high priority" would otherwise parse as high priority with one unknown word
+            return None
+        if UNSUPPORTED_FIELD_PATTERN.search(text):
+            return None
+        word_count = len(text.split())
+        text = f" {text} "
+        conditions = []
+        explanation = []
+        order_by = None
+        limit = None
+
+        def consume(pattern: str) -> Optional[re.Match]:
+            nonlocal text
+            match = re.search(pattern, text)
+            if match:
+                text = text[:match.start()] + " " + text[match.end():]
+            return match
+
+        if mentions_problems:
+            query_type = "problem"
+            states = PROBLEM_STATES
+        else:
+            query_type = "incident"
+            states = INCIDENT_STATES
+
+        # Counting questions become aggregate queries, grouped by at most one field
+        aggregate = consume(r"^ (how many|count(?: of)?|number of|total number of) ") is not None
+        group_by = None
+        if aggregate:
+            phrases = "|".join(sorted((re.escape(phrase) for phrase in GROUP_BY_FIELDS), key=len, reverse=True))
+            match = consume(rf"\b(?:per|by|for each|grouped by|broken down by) ({phrases})\b")
+            if match:
+                group_by = GROUP_BY_FIELDS[match.group(1)]
+
+        # Assignment group first, so priority and state words in a name ("the high availability team") stay in it.
+        # The greedy prefix picks the preposition nearest to "group" ("in the last 7 days for the Network team")
+        group_match = re.search(r"^.*\b((?:assigned to|for|of|in|owned by) (?:the )?([\w -]+?) (?:assignment )?(?:group|team))\b", text)
+        group_name = None
+        if group_match:
+            group_name = self._original_span(question, group_match.group(2))
+            consume(re.escape(group_match.group(1)))
+
+        # Assignment
+        match = consume(r"\b(assigned to me|my ((?:open|active|outstanding|unresolved) )?(?:incidents|problems|tickets))\b")
+        if match:
+            conditions.append("assigned_to=javascript:gs.getUserID()")
+            explanation.append("assigned to the current user")
+            if match.group(2):
+                conditions.append("active=true")
+                explanation.append("active records")
+        elif consume(r"\bunassigned\b"):
+            conditions.append("assigned_toISEMPTY")
+            explanation.append("not assigned to anyone")
+
+        # Priority
+        priorities = []
+        while True:
+            match = consume(r"\b(?:p|priority ?)([1-5])\b")
+            if not match:
+                break
+            priorities.append(match.group(1))
+        for label, value in PRIORITY_LABELS.items():
+            if consume(rf"\b{label}(?: priority)?\b"):
+                priorities.append(value)
+        if priorities:
+            priorities = sorted(set(priorities))
+            conditions.append(f"priority={priorities[0]}" if len(priorities) == 1 else f"priorityIN{','.join(priorities)}")
+            explanation.append(f"priority {', '.join(priorities)}")
+
+        # State
+        if consume(r"\b(open|active|outstanding|unresolved)\b"):
+            conditions.append("active=true")
+            explanation.append("active records")
+        state_label = None
+        for label in sorted(states, key=len, reverse=True):
+            if consume(rf"\b{label}\b"):
+                state_label = label
+                conditions.append(f"state={states[label]}")
+                explanation.append(f"state {label}")
+                break
+
+        # Time window, on opened_at unless a resolved/closed state says otherwise
+        opened_verb = r"(?:(opened|created|raised|logged) )?"
+        window = None
+        match = consume(rf"\b{opened_verb}(?:in )?(?:the )?(?:last|past) (\d+) (hour|day|week|month)s?\b")
+        if match:
+            amount, unit = int(match.group(2)), match.group(3)
+            if unit == "hour":
+                window = (match.group(1), f">=javascript:gs.hoursAgoStart({amount})", f"in the last {amount} {unit}s")
+            elif unit == "month":
+                window = (match.group(1), f">=javascript:gs.monthsAgoStart({amount})", f"in the last {amount} {unit}s")
+            else:
+                window = (match.group(1), f">=javascript:gs.daysAgoStart({amount * 7 if unit == 'week' else amount})", f"in the last {amount} {unit}s")
+        else:
+            match = consume(rf"\b{opened_verb}today\b")
+            if match:
+                window = (match.group(1), ">=javascript:gs.beginningOfToday()", "today")
+            else:
+                match = consume(rf"\b{opened_verb}yesterday\b")
+                if match:
+                    window = (match.group(1), "ONYesterday@javascript:gs.beginningOfYesterday()@javascript:gs.endOfYesterday()", "yesterday")
+        if window:
+            verb, condition, phrase = window
+            if verb or state_label is None:
+                field = "opened_at"
+            elif state_label in STATE_TIME_FIELDS:
+                field = STATE_TIME_FIELDS[state_label]
+            else:
+                # "cancelled in the last week" has no date field of its own
+                return None
+            conditions.append(f"{field}{condition}")
+            explanation.append(f"{field.replace('_at', '')} {phrase}")
+
+        if group_name:
+            conditions.append(f"assignment_group.name={group_name}")
+            explanation.append(f"assignment group {group_name}")
+
+        # Ordering and limits
+        match = consume(r"\b(top|first|last|latest|newest|most recent) (\d+)\b")
+        if match:
+            limit = int(match.group(2))
+            if match.group(1) not in ("top", "first"):
+                order_by = "opened_at"
+        if consume(r"\b(latest|newest|most recent|recent|recently opened)\b"):
+            order_by = "opened_at"
+
+        confidence = self._confidence(text, word_count)
+        if confidence < self.min_confidence:
+            return None
+        if not conditions and not mentions_incidents and not mentions_problems:
+            return None
+
+        sysparm_query = "^".join(conditions)
+        if order_by:
+            sysparm_query = f"{sysparm_query}^ORDERBYDESC{order_by}" if sysparm_query else f"ORDERBYDESC{order_by}"
+
+        if aggregate:
+            aggregate_query = {"table": query_type, "sysparm_query": "^".join(conditions), "sysparm_count": "true"}
+            if group_by:
+                aggregate_query["sysparm_group_by"] = group_by
+            return {
+                "query_type": "aggregate",
+                "incident_query": {},
+                "problem_query": {},
+                "aggregate_query": aggregate_query,
+                "explanation": f"Rule-based parse: count of {query_type} records"
+                    + (f" with {', '.join(explanation)}" if explanation else "")
+                    + (f" per {group_by}" if group_by else "")
+            }, confidence
+
+        table_query = {
+            "sysparm_query": sysparm_query,
+            "sysparm_fields": ",".join(INCIDENT_RETURN_FIELDS if query_type == "incident" else PROBLEM_RETURN_FIELDS),
+            "sysparm_display_value": "true"
+        }
+        if limit:
+            table_query["sysparm_limit"] = limit
+
+        return {
+            "query_type": query_type,
+            "incident_query": table_query if query_type == "incident" else {},
+            "problem_query": table_query if query_type == "problem" else {},
+            "explanation": f"Rule-based parse: {query_type} records" + (f" with {', '.join(explanation)}" if explanation else "")
+        }, confidence
+
+    def _confidence(self, remaining_text: str, word_count: int) -> float:
+        """Share of the question's words that were either matched or are known filler"""
+        unknown = [word for word in remaining_text.split() if word not in FILLER_WORDS]
+        return max(0.0, 1.0 - len(unknown) / max(word_count, 1))
+
+    def _original_span(self, question: str, lowered: str) -> str:
+        """Recover the user's original casing for a matched name"""
+        match = re.search(r"\W+".join(re.escape(word) for word in lowered.split()), question, re.IGNORECASE)
+        return match.group(0) if match else lowered
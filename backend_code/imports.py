@@ -1,8 +1,9 @@
 import os
-from typing import Optional, Dict, Any, List
-from fastapi import FastAPI, HTTPException
+from typing import Optional, Dict, Any, List, AsyncIterator, Tuple
+from fastapi import FastAPI, HTTPException, Request, Response
 from pydantic import BaseModel, field_validator
-import requests
+import httpx
+import asyncio
 from dotenv import load_dotenv
 from langchain_openai import AzureChatOpenAI
 from langchain.prompts import PromptTemplate
@@ -10,4 +11,10 @@ from langchain_core.runnables import RunnablePassthrough
 from langchain_core.output_parsers import JsonOutputParser 
 import time
 from langchain_core.output_parsers import StrOutputParser
-from fastapi.middleware.cors import CORSMiddleware
\ No newline at end of file
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+import re
+import json
+import copy
+import hashlib
+from collections import OrderedDict
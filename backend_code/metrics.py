@@ -0,0 +1,168 @@
+from imports import *
+import uuid
+import contextvars
+from contextlib import contextmanager
+from langchain_core.callbacks import AsyncCallbackHandler
+from prometheus_client import Counter, Histogram, CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+STAGE_SECONDS = Histogram(
+    "servicenow_query_stage_seconds",
+    "Time spent in each query pipeline stage",
+    ["stage"],
+    buckets=(0.0005, 0.005, 0.025, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+QUERIES = Counter(
+    "servicenow_queries_total",
+    "Queries processed, by the parser that handled them",
+    ["parser"]
+)
+FORMATTED_RESPONSES = Counter(
+    "servicenow_formatted_responses_total",
+    "Responses formatted, by formatter path and the policy's reason",
+    ["formatter", "reason"]
+)
+LLM_TOKENS = Counter(
+    "servicenow_llm_tokens_total",
+    "LLM tokens used per stage",
+    ["stage", "kind"]
+)
+SERVICENOW_CALLS = Counter(
+    "servicenow_api_calls_total",
+    "ServiceNow HTTP calls per table and outcome",
+    ["table", "status"]
+)
+SERVICENOW_CALL_SECONDS = Histogram(
+    "servicenow_api_call_seconds",
+    "ServiceNow HTTP call latency per table",
+    ["table"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+SCHEDULER_WAIT_SECONDS = Histogram(
+    "servicenow_scheduler_wait_seconds",
+    "Time calls waited for admission, per downstream resource and priority class",
+    ["resource", "priority"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+SCHEDULER_SHED = Counter(
+    "servicenow_scheduler_shed_total",
+    "Calls refused with 503 because a resource queue was full or too slow",
+    ["resource", "priority"]
+)
+OAUTH_REQUESTS = Counter(
+    "servicenow_oauth_requests_total",
+    "OAuth token requests by grant type and outcome",
+    ["grant_type", "status"]
+)
+
+# Per-request state shared by every task spawned while handling the request
+_request_context: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("request_context", default=None)
+
+
+def start_request(request_id: Optional[str] = None) -> str:
+    """Begin a request context for timings and request ID propagation"""
+    request_id = request_id or uuid.uuid4().hex
+    _request_context.set({"request_id": request_id, "timings": {}, "llm_tokens": {}})
+    return request_id
+
+
+def current_request_id() -> Optional[str]:
+    context = _request_context.get()
+    return context["request_id"] if context else None
+
+
+def get_timings() -> Dict[str, Any]:
+    """Stage timings (ms) and LLM token usage recorded for the current request"""
+    context = _request_context.get()
+    if not context:
+        return {}
+    return {
+        "request_id": context["request_id"],
+        "stages_ms": {stage: round(seconds * 1000, 2) for stage, seconds in context["timings"].items()},
+        "llm_tokens": dict(context["llm_tokens"])
+    }
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Time a pipeline stage into the stage histogram and the current request's timings"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(stage=stage).observe(elapsed)
+        context = _request_context.get()
+        if context is not None:
+            context["timings"][stage] = context["timings"].get(stage, 0.0) + elapsed
+
+
+def record_servicenow_call(endpoint: str, status: str, seconds: float):
+    """Count and time one ServiceNow HTTP call"""
+    table = endpoint.rstrip("/").split("/")[-1]
+    SERVICENOW_CALLS.labels(table=table, status=status).inc()
+    SERVICENOW_CALL_SECONDS.labels(table=table).observe(seconds)
+
+
+class TokenUsageCallback(AsyncCallbackHandler):
+    """Record LLM token usage for a pipeline stage"""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    async def on_llm_end(self, response, **kwargs):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt_tokens = usage.get("prompt_tokens")
+        completion_tokens = usage.get("completion_tokens")
+        if prompt_tokens is None:
+            # Streaming responses report usage on the message instead
+            for generations in response.generations:
+                for generation in generations:
+                    usage_metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    prompt_tokens = (prompt_tokens or 0) + usage_metadata.get("input_tokens", 0)
+                    completion_tokens = (completion_tokens or 0) + usage_metadata.get("output_tokens", 0)
+
+        context = _request_context.get()
+        for kind, count in (("prompt", prompt_tokens), ("completion", completion_tokens)):
+            if count:
+                LLM_TOKENS.labels(stage=self.stage, kind=kind).inc(count)
+                if context is not None:
+                    key = f"{self.stage}_{kind}"
+                    context["llm_tokens"][key] = context["llm_tokens"].get(key, 0) + count
+
+
+class StatsCollector:
+    """Expose nested numeric stats from a callback as Prometheus gauges at scrape time"""
+
+    def __init__(self, prefix: str, stats_fn):
+        self.prefix = prefix
+        self.stats_fn = stats_fn
+
+    def collect(self):
+        for group, stats in self.stats_fn().items():
+            for name, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                metric_name = f"{self.prefix}_{group}_{name}"
+                gauge = GaugeMetricFamily(metric_name, f"{group} {name}")
+                gauge.add_metric([], value)
+                yield gauge
+
+
+_stats_collectors: Dict[str, StatsCollector] = {}
+
+
+def register_stats(prefix: str, stats_fn):
+    """Register a stats callback with the default Prometheus registry, replacing any earlier one for the prefix.
+
+    Worker processes can import app.py twice (as __mp_main__ and as app), which would otherwise register it twice.
+    """
+    if prefix in _stats_collectors:
+        REGISTRY.unregister(_stats_collectors.pop(prefix))
+    _stats_collectors[prefix] = StatsCollector(prefix, stats_fn)
+    REGISTRY.register(_stats_collectors[prefix])
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Prometheus exposition payload and its content type"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
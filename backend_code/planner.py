@@ -0,0 +1,51 @@
+from imports import *
+
+
+class PlanNode:
+    """One step of an execution plan: an async call that receives the results of the steps it depends on"""
+
+    def __init__(self, name: str, run, depends_on: Tuple[str, ...] = ()):
+        self.name = name
+        self.run = run
+        self.depends_on = tuple(depends_on)
+
+
+class ExecutionPlan:
+    """DAG of ServiceNow calls; every node starts as soon as its dependencies finish"""
+
+    def __init__(self):
+        self.nodes: Dict[str, PlanNode] = {}
+
+    def add(self, name: str, run, depends_on: Tuple[str, ...] = ()) -> "ExecutionPlan":
+        """Add a node; dependencies must already be in the plan, which keeps it acyclic"""
+        missing = [dependency for dependency in depends_on if dependency not in self.nodes]
+        if missing:
+            raise ValueError(f"Plan node {name} depends on unknown nodes: {', '.join(missing)}")
+        self.nodes[name] = PlanNode(name, run, depends_on)
+        return self
+
+    def depth(self) -> int:
+        """Longest chain of dependent calls, i.e. the number of sequential round trips"""
+        depths: Dict[str, int] = {}
+        for name, node in self.nodes.items():
+            depths[name] = 1 + max((depths[dependency] for dependency in node.depends_on), default=0)
+        return max(depths.values(), default=0)
+
+    async def execute(self) -> Dict[str, Any]:
+        """Run the plan and return each node's result by name"""
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def run_node(node: PlanNode):
+            inputs = {dependency: await tasks[dependency] for dependency in node.depends_on}
+            return await node.run(inputs)
+
+        # Nodes were added after their dependencies, so insertion order is a topological order
+        for name, node in self.nodes.items():
+            tasks[name] = asyncio.create_task(run_node(node))
+        try:
+            results = await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        return dict(zip(tasks, results))
@@ -0,0 +1,298 @@
+from imports import *
+from fields import *
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+
+# Columns the service reads or filters on beyond the INCIDENT_FIELDS/PROBLEM_FIELDS lists
+REPLICA_EXTRA_COLUMNS = {
+    "incident": ["sys_id", "sys_updated_on", "short_description", "active", "opened_at", "closed_at", "problem_id"],
+    "problem": ["sys_id", "sys_updated_on", "short_description", "active", "opened_at", "closed_at"]
+}
+REPLICA_INDEXES = ["state", "priority", "assignment_group", "problem_id", "active", "sys_updated_on"]
+REPLICA_TABLES = {"incident": INCIDENT_FIELDS, "problem": PROBLEM_FIELDS}
+
+_IDENTIFIER = re.compile(r"^[a-z_][a-z0-9_]*$")
+_TERM = re.compile(r"^([a-z0-9_.]+?)(ISNOTEMPTY|ISEMPTY|NOT IN|NOT LIKE|NOTLIKE|STARTSWITH|ENDSWITH|LIKE|IN|!=|>=|<=|>|<|=)(.*)$")
+_NUMBER = re.compile(r"^-?\d+(\.\d+)?$")
+
+
+def _raw_value(value: Any) -> Optional[str]:
+    """Raw value of a field returned with sysparm_display_value=all"""
+    return value.get("value") if isinstance(value, dict) else value
+
+
+class UnsupportedQuery(Exception):
+    """The encoded query uses something the replica cannot evaluate; the caller should go to ServiceNow"""
+
+
+def _servicenow_time(moment: datetime) -> str:
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _script_value(value: str) -> str:
+    """Evaluate the few relative-date javascript: helpers that map to fixed UTC timestamps"""
+    now = datetime.now(timezone.utc)
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    match = re.fullmatch(r"javascript:gs\.(daysAgoStart|hoursAgoStart|monthsAgoStart)\((\d+)\)", value)
+    if match:
+        amount = int(match.group(2))
+        if match.group(1) == "daysAgoStart":
+            return _servicenow_time(today - timedelta(days=amount))
+        if match.group(1) == "hoursAgoStart":
+            return _servicenow_time(now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=amount))
+        return _servicenow_time((today - timedelta(days=30 * amount)).replace(day=1))
+    if value == "javascript:gs.beginningOfToday()":
+        return _servicenow_time(today)
+    raise UnsupportedQuery(f"script value {value}")
+
+
+class EncodedQueryTranslator:
+    """Translate ServiceNow encoded queries (sysparm_query) into SQL over replica columns"""
+
+    def __init__(self, columns: List[str]):
+        self.columns = set(columns)
+
+    def translate(self, encoded_query: str) -> Tuple[str, List[Any], str]:
+        """Return (where_sql, params, order_sql)"""
+        params: List[Any] = []
+        order_terms: List[str] = []
+        groups = []
+        for group in (encoded_query or "").split("^NQ"):
+            clauses: List[str] = []
+            for term in [term for term in group.split("^") if term]:
+                if term.startswith("ORDERBYDESC"):
+                    order_terms.append(f"{self._column(term[len('ORDERBYDESC'):])} DESC")
+                    continue
+                if term.startswith("ORDERBY"):
+                    order_terms.append(f"{self._column(term[len('ORDERBY'):])} ASC")
+                    continue
+                if term == "EQ":
+                    continue
+                if term.startswith("OR") and clauses and _TERM.match(term[2:]):
+                    clauses[-1] = f"({clauses[-1]} OR {self._condition(term[2:], params)})"
+                    continue
+                clauses.append(self._condition(term, params))
+            if clauses:
+                groups.append("(" + " AND ".join(clauses) + ")")
+
+        where_sql = " OR ".join(groups) if groups else "1=1"
+        order_sql = ", ".join(order_terms)
+        return where_sql, params, order_sql
+
+    def _column(self, field: str) -> str:
+        """Raw column for a field, or the display column for reference.name dot-walks"""
+        field = field.strip()
+        if field.endswith(".name") and field[:-5] in self.columns:
+            return f'"{field[:-5]}__display"'
+        if field in self.columns and _IDENTIFIER.match(field):
+            return f'"{field}"'
+        raise UnsupportedQuery(f"field {field}")
+
+    def _condition(self, term: str, params: List[Any]) -> str:
+        match = _TERM.match(term)
+        if not match:
+            raise UnsupportedQuery(f"term {term}")
+        field, operator, value = match.groups()
+        column = self._column(field)
+        if value.startswith("javascript:"):
+            value = _script_value(value)
+
+        if operator == "ISEMPTY":
+            return f"({column} IS NULL OR {column} = '')"
+        if operator == "ISNOTEMPTY":
+            return f"({column} IS NOT NULL AND {column} != '')"
+        if operator in ("IN", "NOT IN"):
+            values = value.split(",")
+            params.extend(values)
+            placeholders = ", ".join("?" for _ in values)
+            return f"{column} {'NOT IN' if operator == 'NOT IN' else 'IN'} ({placeholders})"
+        if operator in ("LIKE", "NOT LIKE", "NOTLIKE", "STARTSWITH", "ENDSWITH"):
+            escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            pattern = {
+                "STARTSWITH": f"{escaped}%",
+                "ENDSWITH": f"%{escaped}"
+            }.get(operator, f"%{escaped}%")
+            params.append(pattern)
+            negate = "NOT " if operator in ("NOT LIKE", "NOTLIKE") else ""
+            return f"{column} {negate}LIKE ? ESCAPE '\\'"
+        if operator in (">", ">=", "<", "<=") and _NUMBER.match(value):
+            params.append(float(value))
+            return f"CAST({column} AS REAL) {operator} ?"
+        params.append(value)
+        if operator == "!=":
+            return f"({column} IS NULL OR {column} != ? COLLATE NOCASE)"
+        if operator == "=":
+            return f"{column} = ? COLLATE NOCASE"
+        return f"{column} {operator} ?"
+
+
+class LocalReplica:
+    """SQLite replica of the incident and problem tables, kept current by incremental sys_updated_on syncs"""
+
+    def __init__(self, db_path: str, max_staleness: float):
+        self.db_path = db_path
+        self.max_staleness = max_staleness
+        self.columns = {
+            table: sorted({field for field in fields + REPLICA_EXTRA_COLUMNS[table] if _IDENTIFIER.match(field)})
+            for table, fields in REPLICA_TABLES.items()
+        }
+        self.translators = {table: EncodedQueryTranslator(columns) for table, columns in self.columns.items()}
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self.hits = 0
+        self.fallbacks = 0
+        # Per-table (record count, synced_at) for stats(), so metrics scrapes never wait on the replica lock
+        self._table_stats: Dict[str, Tuple[int, float]] = {}
+        self._create_schema()
+        self.refresh_stats()
+
+    def _create_schema(self):
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS replica_sync (table_name TEXT PRIMARY KEY, watermark TEXT, synced_at REAL)"
+            )
+            for table, columns in self.columns.items():
+                column_sql = ", ".join(
+                    f'"{column}" TEXT, "{column}__display" TEXT' for column in columns if column != "sys_id"
+                )
+                self._connection.execute(f'CREATE TABLE IF NOT EXISTS "{table}" (sys_id TEXT PRIMARY KEY, {column_sql})')
+                for column in REPLICA_INDEXES:
+                    if column in columns:
+                        self._connection.execute(
+                            f'CREATE INDEX IF NOT EXISTS "idx_{table}_{column}" ON "{table}" ("{column}")'
+                        )
+
+    def _sync_state(self, table: str) -> Tuple[Optional[str], float]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT watermark, synced_at FROM replica_sync WHERE table_name = ?", (table,)
+            ).fetchone()
+        return (row["watermark"], row["synced_at"]) if row else (None, 0.0)
+
+    def is_fresh(self, table: str) -> bool:
+        """Whether the last successful sync of the table is within the staleness bound"""
+        _, synced_at = self._sync_state(table)
+        return time.time() - synced_at <= self.max_staleness
+
+    def _upsert(self, table: str, records: List[Dict]):
+        columns = self.columns[table]
+        names = ["sys_id"] + [name for column in columns if column != "sys_id" for name in (column, f"{column}__display")]
+        sql = f'INSERT OR REPLACE INTO "{table}" ({", ".join(chr(34) + name + chr(34) for name in names)}) VALUES ({", ".join("?" for _ in names)})'
+        rows = []
+        for record in records:
+            row = []
+            for column in columns:
+                value = record.get(column)
+                # sysparm_display_value=all returns {"value", "display_value"} per field
+                raw, display = (value.get("value"), value.get("display_value")) if isinstance(value, dict) else (value, value)
+                if column == "sys_id":
+                    row.insert(0, raw)
+                else:
+                    row.extend([raw, display])
+            rows.append(row)
+        with self._lock, self._connection:
+            self._connection.executemany(sql, rows)
+
+    def _set_sync_state(self, table: str, watermark: Optional[str], synced_at: float):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO replica_sync (table_name, watermark, synced_at) VALUES (?, ?, ?)",
+                (table, watermark, synced_at)
+            )
+
+    async def sync_table(self, table: str, iter_pages) -> int:
+        """Pull records updated since the last watermark through iter_pages(endpoint, params).
+
+        Pages are keyset-paged on (sys_updated_on, sys_id) rather than by offset, so records
+        updated while the sync runs can't shift the window and make it skip others.
+        """
+        watermark, _ = await asyncio.to_thread(self._sync_state, table)
+        started = time.time()
+        page_size = int(os.getenv("SERVICENOW_PAGE_SIZE", "1000"))
+        params = {
+            "sysparm_fields": ",".join(self.columns[table]),
+            "sysparm_display_value": "all",
+            "sysparm_exclude_reference_link": "true",
+            "sysparm_limit": page_size
+        }
+        order = "ORDERBYsys_updated_on^ORDERBYsys_id"
+        # >= rather than > so records sharing the watermark second are never missed; upserts make repeats harmless
+        query = f"sys_updated_on>={watermark}^{order}" if watermark else order
+        synced = 0
+        while True:
+            page = []
+            async for records in iter_pages(f"/api/now/v2/table/{table}", dict(params, sysparm_query=query)):
+                page.extend(records)
+            if not page:
+                break
+            await asyncio.to_thread(self._upsert, table, page)
+            synced += len(page)
+            updated, sys_id = _raw_value(page[-1].get("sys_updated_on")), _raw_value(page[-1].get("sys_id"))
+            if updated and (watermark is None or updated > watermark):
+                watermark = updated
+            if len(page) < page_size or not (updated and sys_id):
+                break
+            # Next page: later timestamps, or the same timestamp with a later sys_id
+            query = f"sys_updated_on>{updated}^NQsys_updated_on={updated}^sys_id>{sys_id}^{order}"
+        await asyncio.to_thread(self._set_sync_state, table, watermark, started)
+        await asyncio.to_thread(self.refresh_stats, table)
+        return synced
+
+    def query(self, table: str, params: Dict) -> List[Dict]:
+        """Answer a Table API request from the replica, raising UnsupportedQuery when it can't"""
+        where_sql, sql_params, order_sql = self.translators[table].translate(params.get("sysparm_query", ""))
+        fields = [field.strip() for field in str(params.get("sysparm_fields") or "").split(",") if field.strip()]
+        fields = [field for field in fields if field in self.columns[table]] or self.columns[table]
+
+        sql = f'SELECT * FROM "{table}" WHERE {where_sql}'
+        if order_sql:
+            sql += f" ORDER BY {order_sql}"
+        try:
+            limit = int(params.get("sysparm_limit"))
+        except (TypeError, ValueError):
+            limit = -1
+        sql += " LIMIT ? OFFSET ?"
+        sql_params += [limit, int(params.get("sysparm_offset") or 0)]
+
+        with self._lock:
+            rows = self._connection.execute(sql, sql_params).fetchall()
+
+        display_mode = str(params.get("sysparm_display_value", "false")).lower()
+        records = []
+        for row in rows:
+            record = {}
+            for field in fields:
+                raw = row["sys_id"] if field == "sys_id" else row[field]
+                display = raw if field == "sys_id" else row[f"{field}__display"]
+                if display_mode == "true":
+                    record[field] = display
+                elif display_mode == "all":
+                    record[field] = {"value": raw, "display_value": display}
+                else:
+                    record[field] = raw
+            records.append(record)
+        return records
+
+    def refresh_stats(self, table: Optional[str] = None):
+        """Re-read record counts and sync times for stats(); takes the replica lock, so run it in a thread"""
+        for name in [table] if table else self.columns:
+            _, synced_at = self._sync_state(name)
+            with self._lock:
+                count = self._connection.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]
+            self._table_stats[name] = (count, synced_at)
+
+    def stats(self) -> Dict[str, Any]:
+        """Replica freshness and hit counters, as of the last refresh_stats"""
+        stats = {"hits": self.hits, "fallbacks": self.fallbacks}
+        for table in self.columns:
+            count, synced_at = self._table_stats.get(table, (0, 0.0))
+            stats[f"{table}_records"] = count
+            stats[f"{table}_age_seconds"] = round(time.time() - synced_at, 1) if synced_at else None
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
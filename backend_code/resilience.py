@@ -0,0 +1,177 @@
+from imports import *
+import random
+import contextvars
+from email.utils import parsedate_to_datetime
+
+# Statuses worth retrying: rate limiting and gateway/node failures
+RETRYABLE_STATUS = {429, 502, 503, 504}
+
+# Absolute time.monotonic() deadline for the current request, shared by every task it spawns
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out before the work finished"""
+
+
+class CircuitOpenError(Exception):
+    """The ServiceNow instance is failing and calls are being short-circuited"""
+
+
+def start_deadline(seconds: Optional[float] = None) -> float:
+    """Set the current request's deadline, defaulting to REQUEST_DEADLINE_SECONDS"""
+    if seconds is None:
+        seconds = float(os.getenv("REQUEST_DEADLINE_SECONDS", "60"))
+    deadline = time.monotonic() + seconds
+    _deadline.set(deadline)
+    return deadline
+
+
+def remaining_time() -> Optional[float]:
+    """Seconds left in the current request's budget, or None when no deadline is set"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def call_timeout(default: float) -> float:
+    """Timeout for one downstream call: its own default, capped by what is left of the request budget"""
+    remaining = remaining_time()
+    if remaining is None:
+        return default
+    if remaining <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return min(default, remaining)
+
+
+async def with_timeout(awaitable, default: float, what: str):
+    """Await with a per-call timeout taken from the remaining budget"""
+    try:
+        return await asyncio.wait_for(awaitable, timeout=call_timeout(default))
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"{what} timed out")
+
+
+async def iterate_with_timeout(iterator: AsyncIterator, default: float, what: str) -> AsyncIterator:
+    """Iterate a stream, bounding the wait for each item by the per-call timeout and remaining budget"""
+    iterator = iterator.__aiter__()
+    while True:
+        try:
+            item = await with_timeout(iterator.__anext__(), default, what)
+        except StopAsyncIteration:
+            return
+        yield item
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After as seconds, from either delta-seconds or an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Full-jitter exponential backoff, or the server's Retry-After when it sent one"""
+    if retry_after is not None:
+        return retry_after
+    base = float(os.getenv("SERVICENOW_RETRY_BASE_SECONDS", "0.2"))
+    cap = float(os.getenv("SERVICENOW_RETRY_MAX_SECONDS", "5"))
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+async def sleep_before_retry(attempt: int, retry_after: Optional[float] = None):
+    """Back off before a retry, giving up if the wait would outlast the request budget"""
+    delay = backoff_delay(attempt, retry_after)
+    remaining = remaining_time()
+    if remaining is not None and delay >= remaining:
+        raise DeadlineExceeded("Request deadline exceeded while waiting to retry")
+    await asyncio.sleep(delay)
+
+
+async def hedged(fn, hedge_after: Optional[float]):
+    """Await fn(); if it hasn't finished after hedge_after seconds, race a second attempt and take the first success"""
+    if not hedge_after:
+        return await fn()
+
+    attempts = [asyncio.ensure_future(fn())]
+    try:
+        done, _ = await asyncio.wait(attempts, timeout=hedge_after)
+        if not done:
+            attempts.append(asyncio.ensure_future(fn()))
+        pending = set(attempts)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for attempt in done:
+                if attempt.exception() is None:
+                    return attempt.result()
+                error = attempt.exception()
+        raise error
+    finally:
+        for attempt in attempts:
+            attempt.cancel()
+
+
+class CircuitBreaker:
+    """Fail fast after consecutive failures, then let a single trial call through once reset_timeout has passed"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_started: Optional[float] = None
+        self.times_opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        """Raise CircuitOpenError unless a call may go through"""
+        state = self.state
+        if state == "closed":
+            return
+        # A trial that never reported back (e.g. cancelled) is abandoned after another reset_timeout
+        now = time.monotonic()
+        if state == "half_open" and (self.trial_started is None or now - self.trial_started >= self.reset_timeout):
+            self.trial_started = now
+            return
+        self.rejected += 1
+        raise CircuitOpenError("ServiceNow instance is unavailable, failing fast")
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        trial_failed = self.trial_started is not None
+        if trial_failed or self.failures >= self.failure_threshold:
+            if self.opened_at is None or trial_failed:
+                self.times_opened += 1
+            self.opened_at = time.monotonic()
+        self.trial_started = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Current state and failure counters"""
+        state = self.state
+        return {
+            "state": state,
+            "open": int(state != "closed"),
+            "consecutive_failures": self.failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected
+        }
@@ -0,0 +1,153 @@
+from imports import *
+import heapq
+import itertools
+import contextvars
+from contextlib import asynccontextmanager
+from metrics import *
+from resilience import *
+from shared_state import *
+
+# Lower value is served first; interactive /query traffic goes ahead of batches and raw exports
+PRIORITY_CLASSES = {"interactive": 0, "batch": 1, "export": 2}
+# Share of a resource's queue each class may fill, so lower classes are shed first as the queue grows
+QUEUE_SHARES = {"interactive": 1.0, "batch": 0.5, "export": 0.25}
+
+_priority_class: contextvars.ContextVar[str] = contextvars.ContextVar("priority_class", default="interactive")
+
+
+class Overloaded(HTTPException):
+    """A downstream resource's queue is full, or the wait would outlast the request's deadline"""
+
+    def __init__(self, resource: str, retry_after: float):
+        self.resource = resource
+        self.retry_after = retry_after
+        super().__init__(
+            status_code=503,
+            detail=f"{resource} is overloaded, retry after {retry_after:.0f}s",
+            headers={"Retry-After": str(max(1, int(retry_after + 0.999)))}
+        )
+
+
+def set_priority_class(priority_class: str):
+    """Set the scheduling class for downstream calls made by the current request"""
+    if priority_class not in PRIORITY_CLASSES:
+        raise ValueError(f"Unknown priority class {priority_class}")
+    _priority_class.set(priority_class)
+
+
+def current_priority_class() -> str:
+    return _priority_class.get()
+
+
+class ResourceScheduler:
+    """Admission control for one downstream resource.
+
+    At most max_concurrency calls run at once; the rest wait in a bounded queue ordered by
+    priority class, then arrival. A call is refused with Overloaded when its class's share of
+    the queue is full or its expected wait exceeds the request's remaining deadline. Admitted
+    calls then take their cost from the resource's token bucket.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, rate_limiter: Optional[RateLimiter] = None):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self.rate_limiter = rate_limiter
+        self.running = 0
+        self._waiters: List[Tuple[int, int, str, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self.queued = {priority_class: 0 for priority_class in PRIORITY_CLASSES}
+        self.admitted = {priority_class: 0 for priority_class in PRIORITY_CLASSES}
+        self.shed = {priority_class: 0 for priority_class in PRIORITY_CLASSES}
+        # Moving average of how long a call holds its slot, for the expected-wait estimate
+        self.average_hold_seconds = 0.0
+
+    def _expected_wait(self, ahead: int) -> float:
+        return (ahead // self.max_concurrency + 1) * self.average_hold_seconds
+
+    def _shed(self, priority_class: str, wait: float):
+        self.shed[priority_class] += 1
+        SCHEDULER_SHED.labels(resource=self.name, priority=priority_class).inc()
+        raise Overloaded(self.name, max(wait, self.average_hold_seconds, 1.0))
+
+    async def _acquire(self, priority_class: str):
+        """Take a concurrency slot, queueing behind running and higher-priority calls"""
+        if self.running < self.max_concurrency and not self._waiters:
+            self.running += 1
+            return
+
+        depth = len(self._waiters)
+        ahead = sum(1 for waiter in self._waiters if waiter[0] <= PRIORITY_CLASSES[priority_class])
+        expected_wait = self._expected_wait(ahead)
+        if depth >= self.max_queue * QUEUE_SHARES[priority_class]:
+            self._shed(priority_class, expected_wait)
+        remaining = remaining_time()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(f"Request deadline exceeded waiting for {self.name}")
+        if remaining is not None and expected_wait > remaining:
+            self._shed(priority_class, expected_wait)
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (PRIORITY_CLASSES[priority_class], next(self._sequence), priority_class, future)
+        heapq.heappush(self._waiters, waiter)
+        self.queued[priority_class] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=remaining)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as error:
+            if future.done() and not future.cancelled():
+                # The slot was handed over as we gave up; pass it on
+                self._release()
+            else:
+                future.cancel()
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+            if isinstance(error, asyncio.TimeoutError):
+                raise DeadlineExceeded(f"Request deadline exceeded waiting for {self.name}")
+            raise
+        finally:
+            self.queued[priority_class] -= 1
+
+    def _release(self):
+        """Hand the slot to the best waiter, or free it"""
+        while self._waiters:
+            _, _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.running -= 1
+
+    @asynccontextmanager
+    async def slot(self, cost: float = 1.0):
+        """Run one downstream call under admission control, in the current request's priority class"""
+        priority_class = current_priority_class()
+        queued_at = time.perf_counter()
+        await self._acquire(priority_class)
+        admitted_at = time.perf_counter()
+        SCHEDULER_WAIT_SECONDS.labels(resource=self.name, priority=priority_class).observe(admitted_at - queued_at)
+        self.admitted[priority_class] += 1
+        try:
+            if self.rate_limiter is not None:
+                try:
+                    await self.rate_limiter.acquire(max_wait=remaining_time(), cost=cost)
+                except TimeoutError:
+                    raise DeadlineExceeded(f"Request deadline exceeded waiting for the {self.name} rate limit")
+            yield
+        finally:
+            held = time.perf_counter() - admitted_at
+            self.average_hold_seconds = 0.9 * self.average_hold_seconds + 0.1 * held if self.average_hold_seconds else held
+            self._release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Running calls, queue depth and admissions/sheds per priority class"""
+        stats = {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "queued": len(self._waiters),
+            "average_hold_seconds": round(self.average_hold_seconds, 4)
+        }
+        for priority_class in PRIORITY_CLASSES:
+            stats[f"queued_{priority_class}"] = self.queued[priority_class]
+            stats[f"admitted_{priority_class}"] = self.admitted[priority_class]
+            stats[f"shed_{priority_class}"] = self.shed[priority_class]
+        return stats
@@ -0,0 +1,190 @@
+from imports import *
+import csv
+import io
+from collections import Counter
+
+_encoding = None
+
+
+def load_token_encoding():
+    """Load the tiktoken encoding for count_tokens. May download it, so call it from a thread at startup."""
+    global _encoding
+    try:
+        import tiktoken
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"Token encoding unavailable, estimating token counts: {str(e)}")
+
+
+def count_tokens(text: str) -> int:
+    """Count prompt tokens with tiktoken, estimating ~4 characters per token until the encoding is loaded"""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+# Columns whose values repeat across records and are worth replacing with short aliases
+DEDUPE_COLUMNS = ("assignment_group", "assigned_to", "opened_by", "state")
+# Internal identifiers that only cost tokens
+DROPPED_COLUMNS = ("sys_id",)
+SUMMARY_COLUMNS = ("state", "priority", "assignment_group")
+
+
+def _record_rows(results: List[Dict]) -> Dict[str, List[Dict]]:
+    """Flatten result entries into rows per record type"""
+    rows = {"incidents": [], "problems": [], "related_incidents": [], "aggregates": []}
+    for result in results:
+        if result.get("record_type") == "problem":
+            problem = result.get("problem_details", {})
+            rows["problems"].append(problem)
+            for incident in result.get("related_incidents", []):
+                rows["related_incidents"].append(dict(incident, problem=problem.get("number")))
+        elif result.get("record_type") == "incident":
+            rows["incidents"].append(result.get("incident_details", {}))
+        elif result.get("record_type") == "aggregate":
+            rows["aggregates"].append(_aggregate_row(result.get("aggregate_details", {})))
+    return rows
+
+
+def _aggregate_row(details: Dict) -> Dict:
+    """One row per group: the group-by values, then count and avg_/min_/max_/sum_ columns"""
+    row = dict(details.get("group_by") or {})
+    if "count" in details:
+        row["count"] = details["count"]
+    for stat in ("avg", "min", "max", "sum"):
+        for field, value in (details.get(stat) or {}).items():
+            row[f"{stat}_{field}"] = value
+    return row
+
+
+def _cell(value: Any) -> Any:
+    """Reference fields can arrive as {"display_value": ..., "link": ...}"""
+    if isinstance(value, dict):
+        return value.get("display_value") or value.get("value")
+    return value
+
+
+def _count_rank(row: Dict) -> int:
+    try:
+        return -int(row.get("count") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _priority_rank(row: Dict) -> int:
+    match = re.match(r"\s*(\d+)", str(_cell(row.get("priority")) or ""))
+    return int(match.group(1)) if match else 99
+
+
+def _render_table(name: str, rows: List[Dict], aliases: Dict[str, str]) -> str:
+    """Render rows as CSV, dropping columns that are empty in every row"""
+    rows = [{key: _cell(value) for key, value in row.items()} for row in rows]
+    columns = []
+    for row in rows:
+        for key, value in row.items():
+            if key not in columns and key not in DROPPED_COLUMNS and value not in (None, "", [], {}):
+                columns.append(key)
+    if not columns:
+        return f"{name} ({len(rows)}): no fields"
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(columns)
+    for row in rows:
+        cells = []
+        for column in columns:
+            value = row.get(column)
+            value = "" if value is None else str(value)
+            cells.append(aliases.get(value, value) if column in DEDUPE_COLUMNS else value)
+        writer.writerow(cells)
+    return f"{name} ({len(rows)}):\n{buffer.getvalue().rstrip()}"
+
+
+def _build_aliases(tables: Dict[str, List[Dict]]) -> Dict[str, str]:
+    """Short aliases for long values that repeat in the dedupe columns"""
+    counts = Counter()
+    for rows in tables.values():
+        for row in rows:
+            for column in DEDUPE_COLUMNS:
+                value = _cell(row.get(column))
+                if value:
+                    counts[str(value)] += 1
+    repeated = [value for value, count in counts.most_common() if count > 1 and len(value) > 6]
+    return {value: f"@{index}" for index, value in enumerate(repeated, start=1)}
+
+
+def _render(header: str, tables: Dict[str, List[Dict]]) -> str:
+    aliases = _build_aliases(tables)
+    sections = [header]
+    if aliases:
+        sections.append("Legend: " + "; ".join(f"{alias}={value}" for value, alias in aliases.items()))
+    for name, rows in tables.items():
+        if rows:
+            sections.append(_render_table(name, rows, aliases))
+    return "\n\n".join(sections)
+
+
+def _summarize(rows: Dict[str, List[Dict]]) -> str:
+    """Aggregate counts per record type for the fields users usually ask about"""
+    lines = []
+    for name, table in rows.items():
+        if not table:
+            continue
+        if name == "aggregates":
+            counted = sum(-_count_rank(row) for row in table)
+            lines.append(f"{name}: {len(table)} groups covering {counted} records")
+            continue
+        lines.append(f"{name}: {len(table)} total")
+        for column in SUMMARY_COLUMNS:
+            counts = Counter(str(_cell(row.get(column))) for row in table if _cell(row.get(column)))
+            if counts:
+                lines.append(f"  by {column}: " + ", ".join(f"{value}={count}" for value, count in counts.most_common(10)))
+    return "\n".join(lines)
+
+
+def serialize_results_for_prompt(query_results: Dict, token_budget: int, top_n: int = 20) -> Tuple[str, Dict[str, Any]]:
+    """Compact, token-budgeted rendering of query results for the formatter prompt.
+
+    Records are rendered as CSV tables with empty columns dropped and repeated
+    values aliased. If that exceeds the budget, it falls back to aggregate
+    counts plus the top-N records by priority (aggregate groups by count),
+    shrinking N until it fits.
+    """
+    rows = _record_rows(query_results.get("results", []))
+    total_records = sum(len(table) for table in rows.values())
+    header = f"query_type: {query_results.get('query_type', 'unknown')}; total_results: {query_results.get('total_results', len(query_results.get('results', [])))}"
+    if query_results.get("error"):
+        header += f"; error: {query_results['error']}"
+
+    text = _render(header, rows)
+    tokens = count_tokens(text)
+    stats = {
+        "mode": "full",
+        "token_budget": token_budget,
+        "total_records": total_records,
+        "records_included": total_records
+    }
+    if tokens <= token_budget or total_records == 0:
+        stats["query_results_tokens"] = tokens
+        return text, stats
+
+    summary = _summarize(rows)
+    limit = top_n
+    while True:
+        top_rows = {
+            name: sorted(table, key=_count_rank if name == "aggregates" else _priority_rank)[:limit]
+            for name, table in rows.items()
+        }
+        included = sum(len(table) for table in top_rows.values())
+        text = _render(f"{header}\n\nSummary of all results:\n{summary}\n\nTop {limit} records per type by priority:", top_rows)
+        tokens = count_tokens(text)
+        if tokens <= token_budget or limit == 0:
+            break
+        limit //= 2
+
+    stats.update({
+        "mode": "summary",
+        "records_included": included,
+        "query_results_tokens": tokens
+    })
+    return text, stats
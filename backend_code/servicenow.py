@@ -1,12 +1,113 @@
 from imports import *
 from classes import *
 from fields import *
+from cache import *
+from serializer import *
+from fast_parser import *
+from concurrency import *
+from metrics import *
+from replica import *
+from planner import *
+from resilience import *
+from template_formatter import *
+from session import *
+from scheduler import *
+import contextvars
+# Aggregate API parameters the parser may set
+AGGREGATE_PARAMS = ("sysparm_query", "sysparm_group_by", "sysparm_avg_fields", "sysparm_min_fields", "sysparm_max_fields", "sysparm_sum_fields")
+PARSE_FAILURE_MESSAGE = "I'm sorry, I couldn't understand your query. Could you please rephrase your question about ServiceNow incidents or problems?"
+
+# ServiceNow responses already fetched by the current batch, by result cache key, for the life of the batch
+_batch_results: contextvars.ContextVar[Optional[Dict[str, Dict]]] = contextvars.ContextVar("batch_results", default=None)
+
+
 class ServiceNowAPI:
-    def __init__(self, auth_manager: AuthManager, llm: AzureChatOpenAI):
+    def __init__(self, auth_manager: AuthManager, llm: AzureChatOpenAI, state_backend=None):
         self.auth_manager = auth_manager
         self.llm = llm
+        # Second-level caches, locks and the rate limiter shared with other workers
+        self.state = state_backend or auth_manager.state
         self.query_parser_prompt = self._create_query_parser_prompt()
         self.response_formatter_prompt = self._create_response_formatter_prompt()
+        self.fast_parser_enabled = os.getenv("FAST_PARSER_ENABLED", "true").lower() == "true"
+        self.fast_parser = FastQueryParser(min_confidence=float(os.getenv("FAST_PARSER_MIN_CONFIDENCE", "1.0")))
+        self.parsed_query_cache = TTLCache(
+            max_size=int(os.getenv("PARSED_QUERY_CACHE_SIZE", "1000")),
+            ttl=float(os.getenv("PARSED_QUERY_CACHE_TTL", "3600"))
+        )
+        # Editing the parser prompt or the field lists changes this and invalidates old entries
+        self.parser_fingerprint = hashlib.sha256(
+            "\n".join([
+                self.query_parser_prompt.template,
+                ",".join(INCIDENT_FIELDS),
+                ",".join(PROBLEM_FIELDS)
+            ]).encode("utf-8")
+        ).hexdigest()
+        self.result_cache_enabled = os.getenv("SERVICENOW_RESULT_CACHE_ENABLED", "false").lower() == "true"
+        self.result_cache = TTLCache(
+            max_size=int(os.getenv("SERVICENOW_RESULT_CACHE_SIZE", "500")),
+            ttl=float(os.getenv("SERVICENOW_RESULT_CACHE_TTL", "30")),
+            max_bytes=int(os.getenv("SERVICENOW_RESULT_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+        )
+        self.formatter_token_budget = int(os.getenv("FORMATTER_TOKEN_BUDGET", "3000"))
+        self.formatter_top_n = int(os.getenv("FORMATTER_TOP_N", "20"))
+        # Small and empty result sets are rendered from a template instead of a second LLM call
+        self.template_formatter = TemplateFormatter(
+            mode=os.getenv("FORMATTER_MODE", "auto").lower(),
+            max_records=int(os.getenv("TEMPLATE_FORMATTER_MAX_RECORDS", "10"))
+        )
+        self.sessions = SessionStore(
+            self.state,
+            max_sessions=int(os.getenv("SESSION_STORE_SIZE", "1000")),
+            ttl=float(os.getenv("SESSION_TTL_SECONDS", "1800")),
+            max_bytes=int(os.getenv("SESSION_STORE_MAX_BYTES", str(50 * 1024 * 1024))),
+            max_records=int(os.getenv("SESSION_MAX_RECORDS", "500"))
+        )
+        self.refinement_parser = RefinementParser(min_confidence=float(os.getenv("FAST_PARSER_MIN_CONFIDENCE", "0.9")))
+        self.inflight_requests = SingleFlight()
+        self.inflight_queries = SingleFlight()
+        self.result_cache_ttls = {
+            "incident": float(os.getenv("SERVICENOW_RESULT_CACHE_TTL_INCIDENT", "30")),
+            "problem": float(os.getenv("SERVICENOW_RESULT_CACHE_TTL_PROBLEM", "120"))
+        }
+        self.llm_timeout_seconds = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+        self.call_timeout_seconds = float(os.getenv("SERVICENOW_CALL_TIMEOUT_SECONDS", "30"))
+        self.max_retries = int(os.getenv("SERVICENOW_MAX_RETRIES", "2"))
+        # Race a second attempt when a page is slower than this; 0 disables hedging
+        self.hedge_after_seconds = float(os.getenv("SERVICENOW_HEDGE_AFTER_SECONDS", "0"))
+        # Global ServiceNow request rate across all workers sharing the state backend; 0 disables it
+        self.rate_limiter = RateLimiter(
+            self.state,
+            "servicenow",
+            rate=float(os.getenv("SERVICENOW_RATE_LIMIT", "0")),
+            burst=float(os.getenv("SERVICENOW_RATE_BURST", "0")) or None
+        )
+        # Admission control in front of ServiceNow and Azure OpenAI: concurrency caps, bounded priority
+        # queues and token buckets, so bursts are queued or shed instead of hitting downstream 429s
+        self.servicenow_scheduler = ResourceScheduler(
+            "servicenow",
+            max_concurrency=int(os.getenv("SERVICENOW_MAX_CONCURRENCY", "8")),
+            max_queue=int(os.getenv("SERVICENOW_MAX_QUEUE", "200")),
+            rate_limiter=self.rate_limiter
+        )
+        # LLM calls are charged their prompt tokens against the deployment's tokens-per-minute quota
+        llm_tokens_per_minute = float(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+        self.llm_rate_limiter = RateLimiter(self.state, "llm_tokens", rate=llm_tokens_per_minute / 60, burst=llm_tokens_per_minute or None)
+        self.llm_scheduler = ResourceScheduler(
+            "llm",
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+            max_queue=int(os.getenv("LLM_MAX_QUEUE", "100")),
+            rate_limiter=self.llm_rate_limiter
+        )
+        self._parser_prompt_tokens: Optional[int] = None
+        self.replica = None
+        if os.getenv("REPLICA_ENABLED", "false").lower() == "true":
+            self.replica = LocalReplica(
+                db_path=os.getenv("REPLICA_DB_PATH", "servicenow_replica.db"),
+                max_staleness=float(os.getenv("REPLICA_MAX_STALENESS_SECONDS", "300"))
+            )
+        self.replica_sync_interval = float(os.getenv("REPLICA_SYNC_INTERVAL_SECONDS", "60"))
+        self._replica_task: Optional[asyncio.Task] = None
 
     def _create_query_parser_prompt(self):
         """Create enhanced prompt template with detailed parameter handling"""
@@ -64,8 +165,14 @@ class ServiceNowAPI:
         
         Question: {question}
 
+        Counting and Statistics:
+        - For questions that only need counts or statistics (how many, count per, average, oldest/newest per group),
+          use query_type "aggregate" and fill aggregate_query instead of returning records
+        - sysparm_group_by: comma-separated fields to group by, or empty for a single total
+        - sysparm_avg_fields/sysparm_min_fields/sysparm_max_fields/sysparm_sum_fields: comma-separated fields, or empty
+
         Analysis Steps:
-        1. Identify query type (incident/problem/combined)
+        1. Identify query type (incident/problem/combined/aggregate)
         2. Determine specific parameters needed
         3. Consider related records and their parameters
         4. Apply appropriate conditions and filters
@@ -74,7 +181,7 @@ class ServiceNowAPI:
 
         Respond with a JSON structure:
         {{
-            "query_type": "incident" or "problem" or "combined",
+            "query_type": "incident" or "problem" or "combined" or "aggregate",
             "incident_query": {{
                 "sysparm_query": "detailed query conditions",
                 "sysparm_fields": "specific fields to return",
@@ -91,6 +198,17 @@ class ServiceNowAPI:
                 "sysparm_order_by": "field_name",
                 "sysparm_order_by_direction": "DESC/ASC"
             }},
+            "aggregate_query": {{
+                "table": "incident" or "problem",
+                "sysparm_query": "detailed query conditions",
+                "sysparm_group_by": "fields to group by",
+                "sysparm_count": "true",
+                "sysparm_avg_fields": "fields to average",
+                "sysparm_min_fields": "fields to take the minimum of",
+                "sysparm_max_fields": "fields to take the maximum of",
+                "sysparm_sum_fields": "fields to sum",
+                "sysparm_display_value": "true"
+            }},
             "include_related_data": {{
                 "incidents": boolean,
                 "tasks": boolean,
@@ -148,7 +266,63 @@ class ServiceNowAPI:
             template=template
         )
 
-    def get_llm_parsed_query(self, question: str) -> Dict:
+    def _parsed_query_cache_key(self, question: str) -> str:
+        """Cache key combining the normalized question with the parser prompt fingerprint"""
+        return hashlib.sha256(
+            f"{self.parser_fingerprint}:{normalize_question(question)}".encode("utf-8")
+        ).hexdigest()
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for the caches and coalescing counts for in-flight queries and ServiceNow calls"""
+        return {
+            "parsed_query_cache": self.parsed_query_cache.stats(),
+            "result_cache": dict(self.result_cache.stats(), enabled=self.result_cache_enabled),
+            "inflight_requests": self.inflight_requests.stats(),
+            "inflight_queries": self.inflight_queries.stats(),
+            "sessions": self.sessions.stats(),
+            "circuit_breaker": self.auth_manager.circuit_breaker.stats(),
+            "rate_limiter": dict(self.rate_limiter.stats(), backend=self.state.name),
+            "llm_rate_limiter": dict(self.llm_rate_limiter.stats(), backend=self.state.name),
+            "servicenow_scheduler": self.servicenow_scheduler.stats(),
+            "llm_scheduler": self.llm_scheduler.stats(),
+            "replica": dict(self.replica.stats(), enabled=True) if self.replica else {"enabled": False}
+        }
+
+    async def parse_query(self, question: str) -> Tuple[Optional[Dict], Dict[str, Any]]:
+        """Parse a question with the rule-based parser, then the parsed-query cache, then the LLM.
+
+        Returns the parsed query and a record of which parser handled it.
+        """
+        with stage_timer("parse"):
+            parsed_query, parse_info = await self._parse_query(question)
+        QUERIES.labels(parser=parse_info["parser"]).inc()
+        return parsed_query, parse_info
+
+    async def _parse_query(self, question: str) -> Tuple[Optional[Dict], Dict[str, Any]]:
+        if self.fast_parser_enabled:
+            fast_result = self.fast_parser.parse(question)
+            if fast_result is not None:
+                parsed_query, confidence = fast_result
+                return parsed_query, {"parser": "rule", "parser_confidence": round(confidence, 2)}
+
+        cache_key = self._parsed_query_cache_key(question)
+        cached = self.parsed_query_cache.get(cache_key)
+        if cached is not None:
+            # process_query mutates the parsed query, so never hand out the cached object
+            return copy.deepcopy(cached), {"parser": "cache"}
+
+        shared = await self.state.get("parsed_query", cache_key)
+        if shared is not None:
+            self.parsed_query_cache.set(cache_key, copy.deepcopy(shared))
+            return shared, {"parser": "cache"}
+
+        parsed_query = await self.get_llm_parsed_query(question)
+        if parsed_query:
+            self.parsed_query_cache.set(cache_key, copy.deepcopy(parsed_query))
+            await self.state.set("parsed_query", cache_key, parsed_query, ttl=self.parsed_query_cache.ttl)
+        return parsed_query, {"parser": "llm"}
+
+    async def get_llm_parsed_query(self, question: str) -> Dict:
         """Use LLM to parse natural language query into ServiceNow API parameters"""
         output_parser = JsonOutputParser()
         chain = (
@@ -159,17 +333,62 @@ class ServiceNowAPI:
         )
         
         try:
-            return chain.invoke({
-                "question": question,
-                "incident_fields": ", ".join(INCIDENT_FIELDS),
-                "problem_fields": ", ".join(PROBLEM_FIELDS)
-            })
+            async with self.llm_scheduler.slot(cost=self._parse_cost(question)):
+                return await with_timeout(chain.ainvoke({
+                    "question": question,
+                    "incident_fields": ", ".join(INCIDENT_FIELDS),
+                    "problem_fields": ", ".join(PROBLEM_FIELDS)
+                }, config={"callbacks": [TokenUsageCallback("parse")]}), self.llm_timeout_seconds, "LLM query parsing")
+        except (DeadlineExceeded, Overloaded):
+            raise
         except Exception as e:
             print(f"Query parsing error: {str(e)}")
             return None
 
-    def format_response_to_text(self, original_question: str, query_results: Dict) -> str:
-        """Convert query results to human-readable text using LLM"""
+    def _parse_cost(self, question: str) -> float:
+        """Prompt tokens of a parse call, for the LLM token bucket"""
+        if self.llm_rate_limiter.rate <= 0:
+            return 1.0
+        if self._parser_prompt_tokens is None:
+            self._parser_prompt_tokens = count_tokens(self.query_parser_prompt.format(
+                question="",
+                incident_fields=", ".join(INCIDENT_FIELDS),
+                problem_fields=", ".join(PROBLEM_FIELDS)
+            ))
+        return self._parser_prompt_tokens + count_tokens(question)
+
+    def _formatter_inputs(self, original_question: str, query_results: Dict, prompt_stats: Optional[Dict] = None) -> Dict[str, str]:
+        """Compact formatter prompt inputs, recording token counts into prompt_stats when given"""
+        compact_results, stats = serialize_results_for_prompt(
+            query_results, self.formatter_token_budget, self.formatter_top_n
+        )
+        inputs = {
+            "original_question": original_question,
+            "query_results": compact_results
+        }
+        if prompt_stats is not None:
+            prompt_stats.update(stats)
+            prompt_stats["prompt_tokens"] = count_tokens(self.response_formatter_prompt.format(**inputs))
+        return inputs
+
+    def choose_formatter(self, question: str, query_results: Dict) -> Tuple[str, str]:
+        """Template or LLM formatter for these results, and why"""
+        formatter, reason = self.template_formatter.choose(question, query_results)
+        FORMATTED_RESPONSES.labels(formatter=formatter, reason=reason).inc()
+        return formatter, reason
+
+    def _llm_overloaded_fallback(self) -> Tuple[str, str]:
+        """Formatter to use when the LLM queue sheds a formatting call: the data is already fetched, so use the template"""
+        FORMATTED_RESPONSES.labels(formatter="template", reason="llm_overloaded").inc()
+        return "template", "llm_overloaded"
+
+    def format_response_from_template(self, question: str, query_results: Dict) -> str:
+        """Render the response without the LLM"""
+        with stage_timer("format"):
+            return self.template_formatter.format(question, query_results)
+
+    async def format_response_to_text(self, original_question: str, query_results: Dict, prompt_stats: Optional[Dict] = None) -> str:
+        """Convert query results to human-readable text using LLM; raises Overloaded if the LLM queue sheds it"""
         output_parser = StrOutputParser()
         chain = (
             RunnablePassthrough()
@@ -178,132 +397,412 @@ class ServiceNowAPI:
             | output_parser
         )
         
+        prompt_stats = {} if prompt_stats is None else prompt_stats
         try:
-            return chain.invoke({
-                "original_question": original_question,
-                "query_results": str(query_results)
-            })
+            with stage_timer("format"):
+                inputs = self._formatter_inputs(original_question, query_results, prompt_stats)
+                async with self.llm_scheduler.slot(cost=prompt_stats["prompt_tokens"]):
+                    return await with_timeout(chain.ainvoke(
+                        inputs,
+                        config={"callbacks": [TokenUsageCallback("format")]}
+                    ), self.llm_timeout_seconds, "LLM response formatting")
+        except Overloaded:
+            raise
         except Exception as e:
             print(f"Response formatting error: {str(e)}")
             return f"I found some results for your query, but encountered an error formatting the response: {str(e)}"
 
-    def process_query(self, question: str, format_response: bool = True) -> Dict[str, Any]:
-        """Process natural language query with improved response structure"""
+    async def stream_response_text(self, original_question: str, query_results: Dict, prompt_stats: Optional[Dict] = None) -> AsyncIterator[str]:
+        """Stream the human-readable response token by token as the LLM produces it; raises Overloaded if shed"""
+        output_parser = StrOutputParser()
+        chain = (
+            RunnablePassthrough()
+            | self.response_formatter_prompt
+            | self.llm
+            | output_parser
+        )
+        
+        prompt_stats = {} if prompt_stats is None else prompt_stats
         try:
-            parsed_query = self.get_llm_parsed_query(question)
-            if not parsed_query:
-                error_response = {
-                    "query_type": "unknown",
-                    "explanation": "Failed to parse query",
-                    "api_calls": [],
-                    "results": []
-                }
-                
-                if format_response:
-                    return {
-                        "formatted_response": "I'm sorry, I couldn't understand your query. Could you please rephrase your question about ServiceNow incidents or problems?",
-                        "raw_data": error_response
-                    }
-                return error_response
+            with stage_timer("format"):
+                inputs = self._formatter_inputs(original_question, query_results, prompt_stats)
+                async with self.llm_scheduler.slot(cost=prompt_stats["prompt_tokens"]):
+                    tokens = chain.astream(inputs, config={"callbacks": [TokenUsageCallback("format")]})
+                    async for token in iterate_with_timeout(tokens, self.llm_timeout_seconds, "LLM response streaming"):
+                        yield token
+        except Overloaded:
+            raise
+        except Exception as e:
+            print(f"Response formatting error: {str(e)}")
+            yield f"I found some results for your query, but encountered an error formatting the response: {str(e)}"
+
+    def _problem_search_query(self, parsed_query: Dict) -> Dict:
+        """Problem table params for a parsed query"""
+        return {
+            "sysparm_query": parsed_query["problem_query"]["sysparm_query"],
+            "sysparm_fields": "sys_id,number,state,short_description,related_incidents,priority,opened_by,opened",
+            "sysparm_display_value": "true"
+        }
 
-            query_type = parsed_query["query_type"]
-            results = []
-            api_calls = []
+    def _incident_search_query(self, parsed_query: Dict) -> Dict:
+        """Incident table params for a parsed query"""
+        incident_query = parsed_query["incident_query"]
+        # Ensure we get more useful fields for better formatting
+        if "sysparm_fields" in incident_query:
+            additional_fields = ",opened_by,opened,assigned_to,assignment_group"
+            if additional_fields not in incident_query["sysparm_fields"]:
+                incident_query["sysparm_fields"] += additional_fields
+        return incident_query
 
+    def _problem_record(self, problem: Dict, related_incidents: List[Dict]) -> Dict:
+        """Result entry for a problem and its related incidents"""
+        return {
+            "record_type": "problem",
+            "problem_details": {
+                "number": problem.get("number"),
+                "state": problem.get("state"),
+                "description": problem.get("short_description"),
+                "priority": problem.get("priority"),
+                "opened_by": problem.get("opened_by"),
+                "opened": problem.get("opened")
+            },
+            "related_incidents": related_incidents
+        }
+
+    def _incident_record(self, incident: Dict) -> Dict:
+        """Result entry for an incident"""
+        return {
+            "record_type": "incident",
+            "incident_details": {
+                "number": incident.get("number"),
+                "state": incident.get("state"),
+                "description": incident.get("short_description"),
+                "priority": incident.get("priority"),
+                "opened_by": incident.get("opened_by"),
+                "opened": incident.get("opened"),
+                "assigned_to": incident.get("assigned_to"),
+                "assignment_group": incident.get("assignment_group")
+            }
+        }
+
+    def _aggregate_search_query(self, parsed_query: Dict) -> Tuple[str, Dict]:
+        """Table and Aggregate API params for an aggregate query, keeping only the parameters the API accepts"""
+        aggregate_query = parsed_query.get("aggregate_query") or {}
+        table = aggregate_query.get("table") if aggregate_query.get("table") in ("incident", "problem") else "incident"
+        params = {"sysparm_count": "true", "sysparm_display_value": "true"}
+        for key in AGGREGATE_PARAMS:
+            value = aggregate_query.get(key)
+            if value not in (None, "", [], False):
+                params[key] = ",".join(value) if isinstance(value, list) else str(value)
+        return table, params
+
+    def _aggregate_record(self, table: str, row: Dict) -> Dict:
+        """Result entry for one Aggregate API row (a group, or the overall total)"""
+        stats = row.get("stats", {})
+        details = {
+            "table": table,
+            "group_by": {
+                group.get("field"): group.get("display_value") or group.get("value")
+                for group in row.get("groupby_fields", [])
+            }
+        }
+        if "count" in stats:
+            try:
+                details["count"] = int(stats["count"])
+            except (TypeError, ValueError):
+                details["count"] = stats["count"]
+        for stat in ("avg", "min", "max", "sum"):
+            if stats.get(stat):
+                details[stat] = stats[stat]
+        return {"record_type": "aggregate", "aggregate_details": details}
+
+    def _record_call_stats(self, api_call: Dict, response: Dict):
+        """Copy per-call stats from a make_request response onto its api_calls entry"""
+        api_call["request_id"] = current_request_id()
+        for key in ("source", "cache", "pages", "coalesced", "error", "available_count", "truncated"):
+            if key in response:
+                api_call[key] = response[key]
+
+    async def fetch_query_results(self, question: str, bypass_cache: bool = False, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """Parse the question and fetch the matching ServiceNow records.
+
+        With a session_id, follow-ups that filter, sort, limit or project the previous results are answered
+        from the session without calling ServiceNow, and every answered query becomes the session's context.
+        """
+        if session_id and not bypass_cache:
+            refined = await self.refine_session_results(question, session_id)
+            if refined is not None:
+                return refined
+
+        parsed_query, parse_info = await self.parse_query(question)
+        if not parsed_query:
+            response_data = dict({
+                "query_type": "unknown",
+                "explanation": "Failed to parse query",
+                "api_calls": [],
+                "results": []
+            }, **parse_info)
+            if session_id:
+                response_data["session_id"] = session_id
+            return response_data
+
+        with stage_timer("fetch"):
+            results, api_calls, round_trips = await self.execute_parsed_query(parsed_query, bypass_cache)
+
+        response_data = {
+            "query_type": parsed_query["query_type"],
+            "explanation": parsed_query.get("explanation", ""),
+            "api_calls": api_calls,
+            # Sequential ServiceNow round trips the plan needed, the latency floor of the fetch
+            "round_trips": round_trips,
+            "results": results,
+            "total_results": len(results),
+            **parse_info
+        }
+        errors = list(dict.fromkeys(api_call["error"] for api_call in api_calls if api_call.get("error")))
+        if errors:
+            # A failed call must never read as "no results"; partial means the other calls still returned records
+            response_data["error"] = "; ".join(errors)
+            response_data["partial"] = bool(results)
+        if any(api_call.get("truncated") for api_call in api_calls):
+            response_data["truncated"] = True
+        if session_id:
+            await self.sessions.save(session_id, question, parsed_query, response_data)
+            response_data["session_id"] = session_id
+        return response_data
+
+    async def refine_session_results(self, question: str, session_id: str) -> Optional[Dict[str, Any]]:
+        """Answer a follow-up from the session's previous results, or None when it needs a new query"""
+        refinement = self.refinement_parser.parse(question)
+        if refinement is None:
+            return None
+        context = await self.sessions.get(session_id)
+        if context is None or context.get("results") is None:
+            return None
+
+        with stage_timer("refine"):
+            results = apply_refinement(context["results"], refinement)
+        QUERIES.labels(parser="session").inc()
+        response_data = {
+            "query_type": context["query_type"],
+            "explanation": f"Refined the previous {len(context['results'])} results ({refinement['explanation']})",
+            "api_calls": [],
+            "results": results,
+            "total_results": len(results),
+            "parser": "session",
+            "parser_confidence": refinement["confidence"],
+            "session_id": session_id
+        }
+        # The session keeps whole records, so a later follow-up can still filter on fields this one hides
+        await self.sessions.save(session_id, question, context["parsed_query"], response_data)
+        if refinement["fields"]:
+            response_data = dict(response_data, results=project_results(results, refinement["fields"]))
+        return response_data
+
+    def _table_call(self, api_calls: List[Dict], endpoint: str, params: Dict, bypass_cache: bool):
+        """Plan node running one make_request, traced in api_calls at its planned position"""
+        api_call = {
+            "endpoint": endpoint,
+            "params": params
+        }
+        api_calls.append(api_call)
+
+        async def run(inputs: Dict[str, Any]) -> Dict[str, Any]:
+            response = await self.make_request(endpoint, params, bypass_cache)
+            self._record_call_stats(api_call, response)
+            return response
+        return run
+
+    def plan_query(self, parsed_query: Dict, api_calls: List[Dict], bypass_cache: bool = False) -> ExecutionPlan:
+        """Turn a parsed query into a DAG of ServiceNow calls.
+
+        Problem and incident searches are independent and run concurrently; related-incident
+        lookups wait only on the problem search.
+        """
+        query_type = parsed_query["query_type"]
+        plan = ExecutionPlan()
+
+        if query_type == "problem" or query_type == "combined":
+            plan.add("problem_search", self._table_call(
+                api_calls, "/api/now/v2/table/problem", self._problem_search_query(parsed_query), bypass_cache
+            ))
+
+            async def related_incidents(inputs: Dict[str, Any]) -> Dict[str, List[Dict]]:
+                problems = inputs["problem_search"].get("results", [])
+                return await self.fetch_related_incidents(problems, api_calls, bypass_cache)
+            plan.add("related_incidents", related_incidents, depends_on=("problem_search",))
+
+        if query_type == "incident" or (query_type == "combined" and parsed_query.get("incident_query", {}).get("sysparm_query")):
+            plan.add("incident_search", self._table_call(
+                api_calls, "/api/now/v2/table/incident", self._incident_search_query(parsed_query), bypass_cache
+            ))
+
+        if query_type == "aggregate":
+            table, aggregate_query = self._aggregate_search_query(parsed_query)
+            plan.add("aggregate", self._table_call(
+                api_calls, f"/api/now/stats/{table}", aggregate_query, bypass_cache
+            ))
+
+        return plan
+
+    async def execute_parsed_query(self, parsed_query: Dict, bypass_cache: bool = False) -> Tuple[List[Dict], List[Dict], int]:
+        """Run the ServiceNow calls for a parsed query, returning the result entries, the api_calls trace and the plan depth"""
+        api_calls = []
+        plan = self.plan_query(parsed_query, api_calls, bypass_cache)
+        outputs = await plan.execute()
+        results = []
+
+        if "problem_search" in outputs:
+            related_by_problem = outputs["related_incidents"]
+            for problem in outputs["problem_search"].get("results", []):
+                results.append(self._problem_record(problem, related_by_problem.get(problem.get("sys_id"), [])))
+
+        if "incident_search" in outputs:
+            for incident in outputs["incident_search"].get("results", []):
+                results.append(self._incident_record(incident))
+
+        if "aggregate" in outputs:
+            table = parsed_query.get("aggregate_query", {}).get("table")
+            table = table if table in ("incident", "problem") else "incident"
+            for row in outputs["aggregate"].get("results", []):
+                results.append(self._aggregate_record(table, row))
+
+        return results, api_calls, plan.depth()
+
+    async def stream_query_records(self, question: str,
+                                   parsed: Optional[Tuple[Optional[Dict], Dict[str, Any]]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Process a query as a stream of result records, fetched page by page so memory stays bounded.
+
+        parsed is parse_query's result when the caller parsed the question before starting the stream.
+        """
+        if parsed is None:
+            try:
+                parsed = await self.parse_query(question)
+            except Exception as e:
+                print(f"Query parsing error: {str(e)}")
+                yield {"record_type": "error", "error": str(e)}
+                yield {"record_type": "summary", "api_calls": [], "total_results": 0}
+                return
+        parsed_query, parse_info = parsed
+        if not parsed_query:
+            yield {"record_type": "query", "query_type": "unknown", "explanation": "Failed to parse query", **parse_info}
+            yield {"record_type": "summary", "api_calls": [], "total_results": 0}
+            return
+
+        query_type = parsed_query["query_type"]
+        yield {"record_type": "query", "query_type": query_type, "explanation": parsed_query.get("explanation", ""), **parse_info}
+
+        api_calls = []
+        total_results = 0
+        try:
             if query_type == "problem" or query_type == "combined":
-                # First API call to get problem details
-                problem_query = {
-                    "sysparm_query": parsed_query["problem_query"]["sysparm_query"],
-                    "sysparm_fields": "sys_id,number,state,short_description,related_incidents,priority,opened_by,opened",
-                    "sysparm_display_value": "true"
-                }
-                
-                api_calls.append({
+                problem_query = self._problem_search_query(parsed_query)
+                problem_call = {
                     "endpoint": "/api/now/v2/table/problem",
-                    "params": problem_query
-                })
-                
-                problem_results = self.make_request("/api/now/v2/table/problem", problem_query)
+                    "params": problem_query,
+                    "request_id": current_request_id(),
+                    "pages": 0
+                }
+                api_calls.append(problem_call)
                 
-                for problem in problem_results.get("results", []):
-                    problem_data = {
-                        "record_type": "problem",
-                        "problem_details": {
-                            "number": problem.get("number"),
-                            "state": problem.get("state"),
-                            "description": problem.get("short_description"),
-                            "priority": problem.get("priority"),
-                            "opened_by": problem.get("opened_by"),
-                            "opened": problem.get("opened")
-                        },
-                        "related_incidents": []
-                    }
-                    
-                    # Second API call to get related incidents
-                    if problem.get("sys_id"):
-                        incident_query = {
-                            "sysparm_query": f"problem_id={problem['sys_id']}",
-                            "sysparm_fields": "number,short_description,state,priority,sys_id,assigned_to,assignment_group",
-                            "sysparm_display_value": "true"
-                        }
-                        
-                        api_calls.append({
-                            "endpoint": "/api/now/v2/table/incident",
-                            "params": incident_query
-                        })
-                        
-                        related_incidents = self.make_request("/api/now/v2/table/incident", incident_query)
-                        problem_data["related_incidents"] = related_incidents.get("results", [])
-                    
-                    results.append(problem_data)
-
-            elif query_type == "incident":
-                incident_query = parsed_query["incident_query"]
-                # Ensure we get more useful fields for better formatting
-                if "sysparm_fields" in incident_query:
-                    additional_fields = ",opened_by,opened,assigned_to,assignment_group"
-                    if additional_fields not in incident_query["sysparm_fields"]:
-                        incident_query["sysparm_fields"] += additional_fields
+                async for problems in self.iter_pages("/api/now/v2/table/problem", problem_query):
+                    problem_call["pages"] += 1
+                    related_by_problem = await self.fetch_related_incidents(problems, api_calls, bypass_cache=True)
+                    for problem in problems:
+                        total_results += 1
+                        yield self._problem_record(problem, related_by_problem.get(problem.get("sys_id"), []))
+
+            elif query_type == "aggregate":
+                # Aggregate rows are few; fetch them in one call rather than paging
+                table, aggregate_query = self._aggregate_search_query(parsed_query)
+                endpoint = f"/api/now/stats/{table}"
+                aggregate_call = {"endpoint": endpoint, "params": aggregate_query}
+                api_calls.append(aggregate_call)
                 
-                api_calls.append({
+                aggregate_results = await self.make_request(endpoint, aggregate_query, bypass_cache=True)
+                self._record_call_stats(aggregate_call, aggregate_results)
+                if aggregate_results.get("error"):
+                    yield {"record_type": "error", "error": aggregate_results["error"]}
+                for row in aggregate_results.get("results", []):
+                    total_results += 1
+                    yield self._aggregate_record(table, row)
+
+            if query_type == "incident" or (query_type == "combined" and parsed_query.get("incident_query", {}).get("sysparm_query")):
+                incident_query = self._incident_search_query(parsed_query)
+                incident_call = {
                     "endpoint": "/api/now/v2/table/incident",
-                    "params": incident_query
-                })
-                
-                incident_results = self.make_request("/api/now/v2/table/incident", incident_query)
+                    "params": incident_query,
+                    "request_id": current_request_id(),
+                    "pages": 0
+                }
+                api_calls.append(incident_call)
                 
-                for incident in incident_results.get("results", []):
-                    results.append({
-                        "record_type": "incident",
-                        "incident_details": {
-                            "number": incident.get("number"),
-                            "state": incident.get("state"),
-                            "description": incident.get("short_description"),
-                            "priority": incident.get("priority"),
-                            "opened_by": incident.get("opened_by"),
-                            "opened": incident.get("opened"),
-                            "assigned_to": incident.get("assigned_to"),
-                            "assignment_group": incident.get("assignment_group")
-                        }
-                    })
+                async for incidents in self.iter_pages("/api/now/v2/table/incident", incident_query):
+                    incident_call["pages"] += 1
+                    for incident in incidents:
+                        total_results += 1
+                        yield self._incident_record(incident)
 
-            response_data = {
-                "query_type": query_type,
-                "explanation": parsed_query.get("explanation", ""),
-                "api_calls": api_calls,
-                "results": results,
-                "total_results": len(results)
-            }
+        except (httpx.HTTPError, CircuitOpenError, DeadlineExceeded, Overloaded) as e:
+            print(f"ServiceNow API request failed: {str(e)}")
+            yield {"record_type": "error", "error": str(e)}
 
-            if format_response:
-                formatted_text = self.format_response_to_text(question, response_data)
+        yield {"record_type": "summary", "api_calls": api_calls, "total_results": total_results}
+
+    async def process_query(self, question: str, format_response: bool = True, bypass_cache: bool = False,
+                            session_id: Optional[str] = None) -> Dict[str, Any]:
+        """Process natural language query with improved response structure.
+
+        Concurrent identical questions share one parse, fetch and format; shared results are marked "coalesced".
+        """
+        key = f"{normalize_question(question)}|{format_response}|{bypass_cache}|{session_id}"
+        response_data, shared = await self.inflight_queries.do(
+            key, lambda: self._process_query(question, format_response, bypass_cache, session_id)
+        )
+        if shared:
+            response_data["coalesced"] = True
+        return response_data
+
+    async def _process_query(self, question: str, format_response: bool = True, bypass_cache: bool = False,
+                             session_id: Optional[str] = None) -> Dict[str, Any]:
+        """Parse, fetch and optionally format one question"""
+        try:
+            response_data = await self.fetch_query_results(question, bypass_cache, session_id)
+            if not format_response:
+                return response_data
+
+            if response_data["query_type"] == "unknown":
                 return {
-                    "formatted_response": formatted_text,
+                    "formatted_response": PARSE_FAILURE_MESSAGE,
                     "raw_data": response_data
                 }
-            
-            return response_data
 
+            formatter, reason = self.choose_formatter(question, response_data)
+            if formatter == "llm":
+                prompt_stats = {}
+                try:
+                    formatted_text = await self.format_response_to_text(question, response_data, prompt_stats)
+                except Overloaded:
+                    formatter, reason = self._llm_overloaded_fallback()
+                else:
+                    return {
+                        "formatted_response": formatted_text,
+                        "raw_data": response_data,
+                        "formatter": formatter,
+                        "formatter_reason": reason,
+                        "formatter_prompt": prompt_stats
+                    }
+
+            return {
+                "formatted_response": self.format_response_from_template(question, response_data),
+                "raw_data": response_data,
+                "formatter": formatter,
+                "formatter_reason": reason
+            }
+
+        except (Overloaded, DeadlineExceeded):
+            # Shed requests surface as 503 with Retry-After and expired ones as 504, rather than as an empty result
+            raise
         except Exception as e:
             print(f"Error processing query: {str(e)}")
             error_response = {
@@ -321,28 +820,396 @@ class ServiceNowAPI:
                 }
             return error_response
 
-    def make_request(self, endpoint: str, params: Dict) -> Dict[str, Any]:
-        """Make authenticated request to ServiceNow API with improved error handling"""
-        url = f"{self.auth_manager.auth_config.instance_url}{endpoint}"
+    async def process_batch(self, queries: List[Query], max_concurrency: int) -> Dict[str, Any]:
+        """Run a batch of queries concurrently, answering repeated questions once.
+
+        Identical ServiceNow calls across the batch are made once: concurrent ones share the in-flight
+        request and later ones are answered from a batch-scoped memo, whether or not the result cache
+        is enabled. Results come back in input order, each with its own status.
+        """
+        started = time.time()
+        # Set before the item tasks start so they all share it through their context copies
+        batch_results_token = _batch_results.set({})
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        unique_tasks: Dict[str, asyncio.Task] = {}
+        item_keys = []
+
+        batch_request_id = current_request_id()
+
+        async def run(query: Query, item_number: int) -> Dict[str, Any]:
+            # Each task runs in its own context copy, so items get their own request ID and timings
+            if batch_request_id:
+                start_request(f"{batch_request_id}.{item_number}")
+            async with semaphore:
+                # The item's budget starts once it gets a slot, not while it waits behind the rest of the batch
+                start_deadline(query.timeout_seconds)
+                result = await self.process_query(query.question, query.format_response, query.bypass_cache, query.session_id)
+            if query.include_timings:
+                result["timings"] = get_timings()
+            return result
+
+        for query in queries:
+            key = f"{normalize_question(query.question)}|{query.format_response}|{query.bypass_cache}|{query.session_id}"
+            if key not in unique_tasks:
+                unique_tasks[key] = asyncio.ensure_future(run(query, len(unique_tasks)))
+            item_keys.append(key)
+
+        try:
+            await asyncio.gather(*unique_tasks.values(), return_exceptions=True)
+        finally:
+            _batch_results.reset(batch_results_token)
+
+        items = []
+        seen_keys = set()
+        for index, (query, key) in enumerate(zip(queries, item_keys)):
+            item = {"index": index, "question": query.question}
+            task = unique_tasks[key]
+            if task.exception() is not None:
+                error = task.exception()
+                item.update({"status": "error", "error": getattr(error, "detail", None) or str(error)})
+            else:
+                # Duplicates get their own copy of the shared result
+                result = task.result() if key not in seen_keys else copy.deepcopy(task.result())
+                raw_data = result.get("raw_data", result)
+                item.update({"status": "error" if raw_data.get("error") else "ok", "result": result})
+                if key in seen_keys:
+                    item["deduplicated"] = True
+            seen_keys.add(key)
+            items.append(item)
+
+        return {
+            "results": items,
+            "total": len(queries),
+            "unique_questions": len(unique_tasks),
+            "elapsed_seconds": round(time.time() - started, 3)
+        }
+
+    async def stream_query(self, question: str, bypass_cache: bool = False, session_id: Optional[str] = None,
+                           response_data: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Process a query as events: raw_data once the ServiceNow calls finish, then formatter tokens, then done.
+
+        response_data is fetch_query_results' result when the caller fetched before starting the stream.
+        """
+        if response_data is None:
+            try:
+                response_data = await self.fetch_query_results(question, bypass_cache, session_id)
+            except Exception as e:
+                print(f"Error processing query: {str(e)}")
+                yield {"event": "error", "data": {"error": str(e)}}
+                return
+
+        yield {"event": "raw_data", "data": response_data}
+
+        if response_data["query_type"] == "unknown":
+            yield {"event": "token", "data": {"text": PARSE_FAILURE_MESSAGE}}
+            yield {"event": "done", "data": {"formatted_response": PARSE_FAILURE_MESSAGE}}
+            return
+
+        formatter, reason = self.choose_formatter(question, response_data)
+        if formatter == "llm":
+            tokens = []
+            prompt_stats = {}
+            try:
+                # Overloaded is raised before the first token, while waiting for an LLM slot
+                async for token in self.stream_response_text(question, response_data, prompt_stats):
+                    tokens.append(token)
+                    yield {"event": "token", "data": {"text": token}}
+            except Overloaded:
+                formatter, reason = self._llm_overloaded_fallback()
+            else:
+                yield {"event": "done", "data": {
+                    "formatted_response": "".join(tokens),
+                    "formatter": formatter,
+                    "formatter_reason": reason,
+                    "formatter_prompt": prompt_stats
+                }}
+                return
+
+        text = self.format_response_from_template(question, response_data)
+        yield {"event": "token", "data": {"text": text}}
+        yield {"event": "done", "data": {"formatted_response": text, "formatter": formatter, "formatter_reason": reason}}
+
+    async def fetch_related_incidents(self, problems: List[Dict], api_calls: List[Dict], bypass_cache: bool = False) -> Dict[str, List[Dict]]:
+        """Fetch incidents related to the given problems with batched problem_idIN queries, grouped by problem sys_id"""
+        # problem_id comes back as the problem's display value (its number), so map both keys to the sys_id
+        problem_keys = {}
+        for problem in problems:
+            if problem.get("sys_id"):
+                problem_keys[problem["sys_id"]] = problem["sys_id"]
+                if problem.get("number"):
+                    problem_keys[problem["number"]] = problem["sys_id"]
         
+        sys_ids = [problem["sys_id"] for problem in problems if problem.get("sys_id")]
+        chunk_size = int(os.getenv("RELATED_INCIDENT_BATCH_SIZE", "100"))
+        batch_calls = []
+        for start in range(0, len(sys_ids), chunk_size):
+            incident_query = {
+                "sysparm_query": "problem_idIN" + ",".join(sys_ids[start:start + chunk_size]),
+                "sysparm_fields": "number,short_description,state,priority,sys_id,assigned_to,assignment_group,problem_id",
+                "sysparm_display_value": "true",
+                "sysparm_exclude_reference_link": "true"
+            }
+            batch_call = {
+                "endpoint": "/api/now/v2/table/incident",
+                "params": incident_query
+            }
+            api_calls.append(batch_call)
+            batch_calls.append(batch_call)
+        
+        batch_results = await asyncio.gather(*[
+            self.make_request(batch_call["endpoint"], batch_call["params"], bypass_cache)
+            for batch_call in batch_calls
+        ])
+        
+        related_by_problem: Dict[str, List[Dict]] = {}
+        for batch_call, related_incidents in zip(batch_calls, batch_results):
+            self._record_call_stats(batch_call, related_incidents)
+            for incident in related_incidents.get("results", []):
+                problem_ref = incident.pop("problem_id", None)
+                if isinstance(problem_ref, dict):
+                    problem_ref = problem_ref.get("value") or problem_ref.get("display_value")
+                sys_id = problem_keys.get(problem_ref)
+                if sys_id:
+                    related_by_problem.setdefault(sys_id, []).append(incident)
+        return related_by_problem
+
+    def _result_cache_key(self, endpoint: str, params: Dict) -> str:
+        """Cache key from the endpoint and canonicalized params"""
+        canonical_params = json.dumps(
+            {str(key): str(value) for key, value in params.items() if value is not None},
+            sort_keys=True
+        )
+        return hashlib.sha256(f"{endpoint}?{canonical_params}".encode("utf-8")).hexdigest()
+
+    def start_replica_sync(self):
+        """Start the background loop that keeps the local replica in sync"""
+        if self.replica and self._replica_task is None:
+            self._replica_task = asyncio.create_task(self._replica_sync_loop())
+
+    async def _replica_sync_loop(self):
+        """Pull incident/problem changes since the last sys_updated_on watermark every interval"""
+        # Background sync queues behind interactive and batch traffic
+        set_priority_class("export")
+        while True:
+            try:
+                # With several workers on one replica file, whoever holds the lock syncs for everyone
+                async with self.state.lock("replica_sync", timeout=0, ttl=max(600.0, self.replica_sync_interval * 5)):
+                    for table in self.replica.columns:
+                        try:
+                            synced = await self.replica.sync_table(table, self.iter_pages)
+                            if synced:
+                                print(f"Replica synced {synced} {table} records")
+                        except Exception as e:
+                            # The table goes stale and queries fall back to ServiceNow until a sync succeeds
+                            print(f"Replica sync of {table} failed: {str(e)}")
+            except LockTimeout:
+                # Another worker is syncing; pick up its progress for this worker's stats
+                try:
+                    await asyncio.to_thread(self.replica.refresh_stats)
+                except Exception as e:
+                    print(f"Replica stats refresh failed: {str(e)}")
+            await asyncio.sleep(self.replica_sync_interval)
+
+    async def aclose(self):
+        """Stop the replica sync loop and close the replica"""
+        if self._replica_task:
+            self._replica_task.cancel()
+            try:
+                await self._replica_task
+            except asyncio.CancelledError:
+                pass
+            self._replica_task = None
+        if self.replica:
+            self.replica.close()
+
+    async def _query_replica(self, endpoint: str, params: Dict) -> Optional[Dict[str, Any]]:
+        """Answer a Table API request from the local replica if it is fresh and can evaluate the query"""
+        table = endpoint.rstrip("/").split("/")[-1]
+        if not endpoint.startswith("/api/now/v2/table/") or table not in self.replica.columns:
+            return None
+        # The replica's lock is held by upserts from the sync thread, so never wait for it on the event loop
+        if not await asyncio.to_thread(self.replica.is_fresh, table):
+            self.replica.fallbacks += 1
+            return None
+        # Same cap as a ServiceNow fetch: SERVICENOW_MAX_RECORDS, or a smaller explicit sysparm_limit
+        max_records = int(os.getenv("SERVICENOW_MAX_RECORDS", "10000"))
         try:
-            response = requests.get(
-                url, 
-                headers=self.auth_manager._get_headers(), 
-                params=params
-            )
-            response.raise_for_status()
-            
-            data = response.json()
-            if not data.get("result"):
-                return {"results": [], "total_count": 0}
-                
-            results = data["result"] if isinstance(data["result"], list) else [data["result"]]
-            return {
+            limit = min(int(params.get("sysparm_limit")), max_records)
+        except (TypeError, ValueError):
+            limit = max_records
+        try:
+            with stage_timer("replica"):
+                results = await asyncio.to_thread(self.replica.query, table, dict(params, sysparm_limit=limit))
+        except UnsupportedQuery:
+            self.replica.fallbacks += 1
+            return None
+        self.replica.hits += 1
+        return {"results": results, "total_count": len(results), "source": "replica"}
+
+    def _result_cache_ttl(self, endpoint: str) -> Optional[float]:
+        """Per-table result TTL, or None for the cache default"""
+        return self.result_cache_ttls.get(endpoint.rstrip("/").split("/")[-1])
+
+    async def make_request(self, endpoint: str, params: Dict, bypass_cache: bool = False) -> Dict[str, Any]:
+        """Make authenticated request to ServiceNow API, served from the replica or result cache when enabled.
+
+        Identical requests already in flight share one round trip, and a batch answers repeats from its own memo.
+        bypass_cache also skips the replica.
+        """
+        if self.replica and not bypass_cache:
+            replica_data = await self._query_replica(endpoint, params)
+            if replica_data is not None:
+                return replica_data
+
+        cache_key = self._result_cache_key(endpoint, params)
+        batch_results = _batch_results.get()
+        if batch_results is not None and cache_key in batch_results:
+            return dict(copy.deepcopy(batch_results[cache_key]), cache="batch_hit")
+        if not self.result_cache_enabled:
+            cache_status = "disabled"
+        elif bypass_cache:
+            cache_status = "bypass"
+        else:
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                return dict(copy.deepcopy(cached), cache="hit")
+            cached = await self.state.get("result", cache_key)
+            if cached is not None:
+                self.result_cache.set(cache_key, copy.deepcopy(cached), ttl=self._result_cache_ttl(endpoint))
+                return dict(cached, cache="shared_hit")
+            cache_status = "miss"
+
+        response_data, shared = await self.inflight_requests.do(cache_key, lambda: self._fetch(endpoint, params))
+        if batch_results is not None and not response_data.get("error"):
+            batch_results[cache_key] = copy.deepcopy(response_data)
+        if cache_status == "miss" and not shared and not response_data.get("error"):
+            ttl = self._result_cache_ttl(endpoint)
+            self.result_cache.set(cache_key, copy.deepcopy(response_data), ttl=ttl)
+            await self.state.set("result", cache_key, response_data, ttl=self.result_cache.ttl if ttl is None else ttl)
+        if shared:
+            response_data["coalesced"] = True
+        return dict(response_data, cache=cache_status)
+
+    async def _fetch(self, endpoint: str, params: Dict) -> Dict[str, Any]:
+        """Make authenticated request to ServiceNow API, collecting every page up to SERVICENOW_MAX_RECORDS"""
+        max_records = int(os.getenv("SERVICENOW_MAX_RECORDS", "10000"))
+        results = []
+        pages = 0
+        
+        page_info = {}
+        
+        try:
+            async for page in self.iter_pages(endpoint, params, max_records, page_info):
+                results.extend(page)
+                pages += 1
+            response_data = {
                 "results": results,
-                "total_count": len(results)
+                "total_count": len(results),
+                "pages": pages
             }
+            # Say so when SERVICENOW_MAX_RECORDS, rather than the caller's own sysparm_limit, cut the results short
+            try:
+                capped = int(params.get("sysparm_limit")) > max_records
+            except (TypeError, ValueError):
+                capped = True
+            available = page_info.get("total_count")
+            if available is not None:
+                response_data["available_count"] = available
+            if capped and len(results) >= max_records and (available is None or available > len(results)):
+                response_data["truncated"] = True
+                print(f"ServiceNow results for {endpoint} truncated at SERVICENOW_MAX_RECORDS={max_records}"
+                      + (f" of {available}" if available is not None else ""))
+            return response_data
             
-        except requests.exceptions.RequestException as e:
+        except (httpx.HTTPError, CircuitOpenError) as e:
             print(f"ServiceNow API request failed: {str(e)}")
-            return {"results": [], "total_count": 0}
\ No newline at end of file
+            return {"results": [], "total_count": 0, "pages": pages, "error": str(e)}
+
+    async def iter_pages(self, endpoint: str, params: Dict, max_records: Optional[int] = None,
+                         page_info: Optional[Dict] = None) -> AsyncIterator[List[Dict]]:
+        """Page through a ServiceNow table with sysparm_offset/sysparm_limit, yielding each page's records.
+
+        page_info, when given, receives the instance's X-Total-Count as "total_count".
+        """
+        url = f"{self.auth_manager.auth_config.instance_url}{endpoint}"
+        page_size = int(os.getenv("SERVICENOW_PAGE_SIZE", "1000"))
+        
+        # An explicit sysparm_limit caps the total number of records, not the page size
+        try:
+            limit = int(params.get("sysparm_limit"))
+        except (TypeError, ValueError):
+            limit = None
+        if max_records is not None:
+            limit = min(limit, max_records) if limit is not None else max_records
+        
+        # The Aggregate API returns every group in one response and has no offset paging
+        paged = not endpoint.startswith("/api/now/stats/")
+        offset = int(params.get("sysparm_offset") or 0)
+        fetched = 0
+        while limit is None or fetched < limit:
+            page_limit = page_size if limit is None else min(page_size, limit - fetched)
+            page_params = dict(params, sysparm_limit=page_limit, sysparm_offset=offset) if paged else params
+            response = await self._get_page(endpoint, url, page_params)
+            
+            data = response.json()
+            result = data.get("result") or []
+            page = result if isinstance(result, list) else [result]
+            total_count = response.headers.get("X-Total-Count")
+            if total_count is not None and page_info is not None:
+                page_info["total_count"] = int(total_count)
+            if page:
+                yield page
+            
+            fetched += len(page)
+            offset += len(page)
+            if not paged or len(page) < page_limit or not isinstance(result, list):
+                break
+            if total_count is not None and offset >= int(total_count):
+                break
+            link = response.headers.get("Link")
+            if link is not None and 'rel="next"' not in link:
+                break
+
+    async def _get_page(self, endpoint: str, url: str, params: Dict) -> httpx.Response:
+        """GET one page through the instance circuit breaker, retrying transient failures with jittered backoff"""
+        breaker = self.auth_manager.circuit_breaker
+        for attempt in range(self.max_retries + 1):
+            breaker.allow()
+            retry_after = None
+            try:
+                response = await hedged(lambda: self._send_get(endpoint, url, params), self.hedge_after_seconds)
+            except httpx.TransportError:
+                breaker.record_failure()
+                if attempt == self.max_retries:
+                    raise
+            else:
+                if response.status_code >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                if response.status_code not in RETRYABLE_STATUS or attempt == self.max_retries:
+                    response.raise_for_status()
+                    return response
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            await sleep_before_retry(attempt, retry_after)
+
+    async def _send_get(self, endpoint: str, url: str, params: Dict) -> httpx.Response:
+        """One timed GET, bounded by the per-call timeout and the remaining request budget"""
+        headers = await self.auth_manager._get_headers()
+        async with self.servicenow_scheduler.slot():
+            started = time.perf_counter()
+            timeout = call_timeout(self.call_timeout_seconds)
+            try:
+                # httpx timeouts bound each connect/read; wait_for bounds the call as a whole
+                response = await asyncio.wait_for(
+                    self.auth_manager.get_http_client().get(url, headers=headers, params=params, timeout=timeout),
+                    timeout=timeout
+                )
+            except asyncio.TimeoutError:
+                record_servicenow_call(endpoint, "timeout", time.perf_counter() - started)
+                raise httpx.ReadTimeout(f"ServiceNow request timed out after {timeout:.1f}s")
+            except httpx.HTTPError:
+                record_servicenow_call(endpoint, "error", time.perf_counter() - started)
+                raise
+        record_servicenow_call(endpoint, str(response.status_code), time.perf_counter() - started)
+        return response
@@ -0,0 +1,264 @@
+from imports import *
+from cache import *
+from fast_parser import *
+from template_formatter import *
+
+# Words that point back at the previous result set; a follow-up must use one to be refined locally
+REFERENCE_PATTERN = re.compile(r"\b(those|them|these|they|ones|that list|previous results|same results|above)\b")
+# A table noun names a new result set unless it is tied to a reference ("those incidents")
+TABLE_NOUN_PATTERN = re.compile(r"\b(incidents?|problems?|tickets?|records?)\b")
+REFERRED_NOUN_PATTERN = re.compile(r"\b(?:those|these|them|same|previous|above) (?:incidents?|problems?|tickets?|records?)\b")
+
+REFINEMENT_FILLER_WORDS = FILLER_WORDS | {
+    "those", "them", "these", "they", "ones", "that", "list", "previous", "same", "results", "above",
+    "only", "just", "keep", "filter", "narrow", "down", "out", "sort", "sorted", "order", "ordered",
+    "it", "now", "then", "first", "s", "fields", "columns", "column", "field"
+}
+
+# Detail fields a follow-up can sort by or project, by the words users use for them
+REFINEMENT_FIELDS = {
+    "numbers": "number",
+    "number": "number",
+    "descriptions": "description",
+    "description": "description",
+    "states": "state",
+    "state": "state",
+    "status": "state",
+    "priorities": "priority",
+    "priority": "priority",
+    "assignees": "assigned_to",
+    "assignee": "assigned_to",
+    "assignment groups": "assignment_group",
+    "assignment group": "assignment_group",
+    "groups": "assignment_group",
+    "group": "assignment_group",
+    "opened dates": "opened",
+    "opened date": "opened",
+    "open date": "opened",
+    "opened": "opened",
+    "date": "opened",
+    "opened by": "opened_by"
+}
+
+# States that "open" / "active" excludes, as display labels and raw codes
+INACTIVE_STATES = {"resolved", "closed", "cancelled", "canceled", "6", "7", "8", "106", "107"}
+
+DETAIL_KEYS = {"incident": "incident_details", "problem": "problem_details"}
+
+
+def _field_pattern() -> str:
+    return "|".join(sorted((re.escape(phrase) for phrase in REFINEMENT_FIELDS), key=len, reverse=True))
+
+
+class RefinementParser:
+    """Rule-based parser for follow-ups that filter, sort, limit or project the previous result set"""
+
+    def __init__(self, min_confidence: float = 0.9):
+        self.min_confidence = min_confidence
+
+    def parse(self, question: str) -> Optional[Dict[str, Any]]:
+        """Return the refinement to apply, or None when the follow-up needs a new query"""
+        text = " ".join(re.sub(r"[^\w\s-]", " ", question.lower()).split())
+        if not REFERENCE_PATTERN.search(text):
+            return None
+        if TABLE_NOUN_PATTERN.search(REFERRED_NOUN_PATTERN.sub(" ", text)):
+            # "open incidents for the network team and sort them by priority" is a new question
+            return None
+        word_count = len(text.split())
+        text = f" {text} "
+        fields = _field_pattern()
+        refinement = {"filters": [], "sort": None, "limit": None, "fields": None}
+        explanation = []
+
+        def consume(pattern: str) -> Optional[re.Match]:
+            nonlocal text
+            match = re.search(pattern, text)
+            if match:
+                text = text[:match.start()] + " " + text[match.end():]
+            return match
+
+        # Projection: "show only the numbers and descriptions"
+        match = consume(rf"\b(?:only|just) (?:the )?((?:{fields})(?:(?: ,| and|,? and the) (?:{fields}))*)\b")
+        if match:
+            chosen = []
+            for phrase in re.findall(fields, match.group(1)):
+                if REFINEMENT_FIELDS[phrase] not in chosen:
+                    chosen.append(REFINEMENT_FIELDS[phrase])
+            refinement["fields"] = chosen
+            explanation.append(f"showing {', '.join(chosen)}")
+
+        # Sorting
+        match = consume(rf"\b(?:sort|sorted|order|ordered|rank|ranked) (?:them |those |these |it )?by (?:the )?({fields})"
+                        r"(?: (ascending|descending|asc|desc|newest first|oldest first|highest first|lowest first))?\b")
+        if match:
+            field = REFINEMENT_FIELDS[match.group(1)]
+            direction = match.group(2) or ""
+            if field == "priority" and direction in ("highest first", "lowest first"):
+                # Priority 1 is the highest, so "highest first" is ascending by number
+                descending = direction == "lowest first"
+            elif direction in ("descending", "desc", "newest first", "highest first"):
+                descending = True
+            elif direction in ("ascending", "asc", "oldest first", "lowest first"):
+                descending = False
+            else:
+                # Dates default to newest first, everything else ascending
+                descending = field == "opened"
+            refinement["sort"] = {"field": field, "descending": descending}
+        else:
+            match = consume(r"\b(newest|latest|most recent|oldest) first\b")
+            if match:
+                refinement["sort"] = {"field": "opened", "descending": match.group(1) != "oldest"}
+        if refinement["sort"]:
+            sort = refinement["sort"]
+            explanation.append(f"sorted by {sort['field']} {'descending' if sort['descending'] else 'ascending'}")
+
+        # Limit
+        match = consume(r"\b(?:top|first|only|just|latest|newest) (\d+)\b")
+        if match:
+            refinement["limit"] = int(match.group(1))
+            explanation.append(f"first {refinement['limit']}")
+
+        # Priority filter: "only the P1s", "the critical ones"
+        priorities = set()
+        while True:
+            match = consume(r"\b(?:p|priority ?)([1-5])s?\b")
+            if not match:
+                break
+            priorities.add(int(match.group(1)))
+        for label, value in PRIORITY_LABELS.items():
+            if consume(rf"\b{label}(?: priority)?(?: ones)?\b"):
+                priorities.add(int(value))
+        if priorities:
+            refinement["filters"].append({"field": "priority", "in": sorted(priorities)})
+            explanation.append(f"priority {', '.join(str(priority) for priority in sorted(priorities))}")
+
+        # State filter
+        if consume(r"\b(open|active|outstanding|unresolved)\b"):
+            refinement["filters"].append({"field": "state", "active": True})
+            explanation.append("still open")
+        states = dict(INCIDENT_STATES)
+        states.update(PROBLEM_STATES)
+        for label in sorted(states, key=len, reverse=True):
+            if consume(rf"\b{label}\b"):
+                codes = {code for name, code in list(INCIDENT_STATES.items()) + list(PROBLEM_STATES.items()) if name == label}
+                refinement["filters"].append({"field": "state", "in": sorted(codes | {label})})
+                explanation.append(f"state {label}")
+                break
+
+        # Assignment
+        if consume(r"\bunassigned\b"):
+            refinement["filters"].append({"field": "assigned_to", "empty": True})
+            explanation.append("unassigned")
+        # The greedy prefix picks the preposition nearest to "group" ("which of those are in the Network group")
+        match = re.search(r"^.*\b((?:assigned to|for|of|in|owned by) (?:the )?([\w -]+?) (?:assignment )?(?:group|team))\b", text)
+        if match:
+            consume(re.escape(match.group(1)))
+            refinement["filters"].append({"field": "assignment_group", "contains": match.group(2).strip()})
+            explanation.append(f"assignment group {match.group(2).strip()}")
+
+        if not (refinement["filters"] or refinement["sort"] or refinement["limit"] or refinement["fields"]):
+            return None
+        unknown = [word for word in text.split() if word not in REFINEMENT_FILLER_WORDS]
+        confidence = max(0.0, 1.0 - len(unknown) / max(word_count, 1))
+        if confidence < self.min_confidence:
+            return None
+        refinement["explanation"] = ", ".join(explanation)
+        refinement["confidence"] = round(confidence, 2)
+        return refinement
+
+
+def _matches(details: Dict, condition: Dict) -> bool:
+    value = display_text(details.get(condition["field"]))
+    if condition.get("empty"):
+        return not value
+    if condition.get("active"):
+        return value.lower() not in INACTIVE_STATES
+    if "contains" in condition:
+        return condition["contains"].lower() in value.lower()
+    if condition["field"] == "priority":
+        return priority_rank(value) in condition["in"]
+    return value.lower() in condition["in"]
+
+
+def _sort_key(details: Dict, field: str):
+    """Comparable value for a sort field, or None when the record has none"""
+    value = details.get(field)
+    if field == "priority":
+        rank = priority_rank(value)
+        return None if rank == 99 else rank
+    if field == "opened":
+        return parse_date(value)
+    text = display_text(value)
+    return text.lower() or None
+
+
+def apply_refinement(results: List[Dict], refinement: Dict) -> List[Dict]:
+    """Filter, sort and limit incident and problem result entries in-process"""
+    refined = []
+    for result in results:
+        details = result.get(DETAIL_KEYS.get(result.get("record_type"), ""), {})
+        if all(_matches(details, condition) for condition in refinement["filters"]):
+            refined.append(result)
+
+    sort = refinement.get("sort")
+    if sort:
+        def details_of(result: Dict) -> Dict:
+            return result.get(DETAIL_KEYS.get(result.get("record_type"), ""), {})
+        present = [result for result in refined if _sort_key(details_of(result), sort["field"]) is not None]
+        missing = [result for result in refined if _sort_key(details_of(result), sort["field"]) is None]
+        present.sort(key=lambda result: _sort_key(details_of(result), sort["field"]), reverse=sort["descending"])
+        refined = present + missing
+
+    if refinement.get("limit"):
+        refined = refined[:refinement["limit"]]
+    return refined
+
+
+def project_results(results: List[Dict], fields: List[str]) -> List[Dict]:
+    """Copies of the result entries with only the given detail fields, plus the record number"""
+    keep = ["number"] + [field for field in fields if field != "number"]
+    projected = []
+    for result in results:
+        key = DETAIL_KEYS[result["record_type"]]
+        projected.append(dict(result, **{key: {field: result[key].get(field) for field in keep}}))
+    return projected
+
+
+class SessionStore:
+    """Last parsed query and result set per conversation, bounded by session count, idle time and bytes"""
+
+    def __init__(self, state_backend, max_sessions: int, ttl: float, max_bytes: int, max_records: int):
+        self.state = state_backend
+        self.sessions = TTLCache(max_size=max_sessions, ttl=ttl, max_bytes=max_bytes)
+        self.max_records = max_records
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """The session's last query context, from this worker or, when shared, another one"""
+        context = self.sessions.get(session_id)
+        if context is None:
+            context = await self.state.get("session", session_id)
+            if context is None:
+                return None
+            self.sessions.set(session_id, context)
+        # Refinements build new result lists, but never hand out the stored entries
+        return copy.deepcopy(context)
+
+    async def save(self, session_id: str, question: str, parsed_query: Optional[Dict], response_data: Dict):
+        """Remember a query and its results; result sets over max_records keep only the query"""
+        results = response_data.get("results", [])
+        refinable = len(results) <= self.max_records and all(
+            result.get("record_type") in DETAIL_KEYS for result in results
+        )
+        context = {
+            "question": question,
+            "parsed_query": parsed_query,
+            "query_type": response_data.get("query_type"),
+            "explanation": response_data.get("explanation", ""),
+            "results": results if refinable else None,
+            "updated_at": time.time()
+        }
+        self.sessions.set(session_id, context)
+        await self.state.set("session", session_id, context, ttl=self.sessions.ttl)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.sessions.stats(), max_records=self.max_records)
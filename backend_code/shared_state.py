@@ -0,0 +1,230 @@
+from imports import *
+import uuid
+import sqlite3
+import threading
+from contextlib import asynccontextmanager
+
+
+class LockTimeout(Exception):
+    """A shared lock could not be acquired in time"""
+
+
+class LocalStateBackend:
+    """Single-process backend: nothing is shared, locks and rate limits are in-process"""
+
+    name = "local"
+
+    def __init__(self):
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    async def get(self, namespace: str, key: str) -> Optional[Any]:
+        return None
+
+    async def set(self, namespace: str, key: str, value: Any, ttl: float):
+        return None
+
+    @asynccontextmanager
+    async def lock(self, name: str, timeout: float = 10.0, ttl: float = 60.0):
+        """Hold a named lock, raising LockTimeout if it isn't free within timeout seconds"""
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        if timeout <= 0:
+            if lock.locked():
+                raise LockTimeout(name)
+            await lock.acquire()
+        else:
+            try:
+                await asyncio.wait_for(lock.acquire(), timeout=timeout)
+            except asyncio.TimeoutError:
+                raise LockTimeout(name)
+        try:
+            yield
+        finally:
+            lock.release()
+
+    async def take_token(self, name: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        """Take cost tokens from a bucket; returns 0 on success or the seconds until they are available"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(name, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens >= cost:
+            self._buckets[name] = (tokens - cost, now)
+            return 0.0
+        self._buckets[name] = (tokens, now)
+        return (cost - tokens) / rate
+
+    def close(self):
+        return None
+
+
+class SQLiteStateBackend:
+    """State shared by every worker on the host through one SQLite file"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        new_file = not os.path.exists(path)
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=5.0, isolation_level=None)
+        if new_file:
+            # The file holds the ServiceNow access token
+            os.chmod(path, 0o600)
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS kv (namespace TEXT, key TEXT, value TEXT, expires_at REAL, PRIMARY KEY (namespace, key))"
+            )
+            self._connection.execute("CREATE TABLE IF NOT EXISTS locks (name TEXT PRIMARY KEY, owner TEXT, expires_at REAL)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL, updated_at REAL)")
+
+    def _execute(self, fn):
+        """Run fn(connection) in one IMMEDIATE transaction so read-modify-write is atomic across processes"""
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._connection)
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+            return result
+
+    def _get(self, namespace: str, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, expires_at FROM kv WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return json.loads(row[0])
+
+    def _set(self, namespace: str, key: str, payload: str, ttl: float):
+        now = time.time()
+
+        def write(connection):
+            connection.execute(
+                "INSERT OR REPLACE INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, payload, now + ttl)
+            )
+            # Expired entries are swept on write so the file doesn't grow without bound
+            connection.execute("DELETE FROM kv WHERE expires_at <= ?", (now,))
+        self._execute(write)
+
+    async def get(self, namespace: str, key: str) -> Optional[Any]:
+        return await asyncio.to_thread(self._get, namespace, key)
+
+    async def set(self, namespace: str, key: str, value: Any, ttl: float):
+        if ttl > 0:
+            # Serialize on the event loop, before the caller can mutate value
+            await asyncio.to_thread(self._set, namespace, key, json.dumps(value, default=str), ttl)
+
+    def _try_lock(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+
+        def acquire(connection):
+            row = connection.execute("SELECT expires_at FROM locks WHERE name = ?", (name,)).fetchone()
+            if row is not None and row[0] > now:
+                return False
+            connection.execute(
+                "INSERT OR REPLACE INTO locks (name, owner, expires_at) VALUES (?, ?, ?)", (name, owner, now + ttl)
+            )
+            return True
+        return self._execute(acquire)
+
+    def _unlock(self, name: str, owner: str):
+        self._execute(lambda connection: connection.execute(
+            "DELETE FROM locks WHERE name = ? AND owner = ?", (name, owner)
+        ))
+
+    @asynccontextmanager
+    async def lock(self, name: str, timeout: float = 10.0, ttl: float = 60.0):
+        """Hold a cross-process lock, raising LockTimeout if it isn't free within timeout seconds.
+
+        The lock expires after ttl seconds so a crashed worker can't hold it forever.
+        """
+        owner = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout
+        while not await asyncio.to_thread(self._try_lock, name, owner, ttl):
+            if time.monotonic() >= deadline:
+                raise LockTimeout(name)
+            await asyncio.sleep(0.05)
+        try:
+            yield
+        finally:
+            await asyncio.to_thread(self._unlock, name, owner)
+
+    def _take_token(self, name: str, rate: float, burst: float, cost: float) -> float:
+        now = time.time()
+
+        def take(connection):
+            row = connection.execute("SELECT tokens, updated_at FROM buckets WHERE name = ?", (name,)).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            connection.execute(
+                "INSERT OR REPLACE INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)", (name, tokens, now)
+            )
+            return wait
+        return self._execute(take)
+
+    async def take_token(self, name: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        """Take cost tokens from a bucket shared by all workers; returns 0 or the seconds to wait"""
+        return await asyncio.to_thread(self._take_token, name, rate, burst, cost)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class RateLimiter:
+    """Token-bucket limit on calls (or on a per-call cost such as LLM tokens), enforced across workers when the backend is shared"""
+
+    def __init__(self, backend, name: str, rate: float, burst: Optional[float] = None):
+        self.backend = backend
+        self.name = name
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    async def acquire(self, max_wait: Optional[float] = None, cost: float = 1.0):
+        """Wait for cost tokens; raises TimeoutError if it would take longer than max_wait"""
+        if self.rate <= 0:
+            return
+        # A call costing more than the burst could never be admitted, so it waits for a full bucket instead
+        cost = min(cost, self.burst)
+        waited = 0.0
+        while True:
+            wait = await self.backend.take_token(self.name, self.rate, self.burst, cost)
+            if wait <= 0:
+                break
+            if max_wait is not None and waited + wait > max_wait:
+                raise TimeoutError(f"Rate limit {self.name} wait exceeds the remaining budget")
+            await asyncio.sleep(wait)
+            waited += wait
+        if waited:
+            self.waits += 1
+            self.wait_seconds += waited
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rate_per_second": self.rate,
+            "burst": self.burst,
+            "waits": self.waits,
+            "wait_seconds": round(self.wait_seconds, 3)
+        }
+
+
+def create_state_backend():
+    """Backend named by SHARED_STATE_BACKEND: "local" (default) or "sqlite" at SHARED_STATE_PATH"""
+    backend = os.getenv("SHARED_STATE_BACKEND", "local").lower()
+    if backend == "sqlite":
+        return SQLiteStateBackend(os.getenv("SHARED_STATE_PATH", "servicenow_shared_state.db"))
+    if backend != "local":
+        print(f"Unknown SHARED_STATE_BACKEND {backend}, using local state")
+    return LocalStateBackend()
@@ -0,0 +1,224 @@
+from imports import *
+from datetime import datetime
+
+# Date formats ServiceNow returns for display values
+DATE_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d", "%m/%d/%Y %H:%M:%S", "%d/%m/%Y %H:%M:%S")
+
+# Questions that want analysis rather than a listing go to the LLM formatter
+ANALYTICAL_PATTERN = re.compile(
+    r"\b(why|explain|analy[sz]e|analysis|summari[sz]e|summary|compare|comparison|trends?|patterns?|"
+    r"recommend|suggest|root cause|insights?|impact|should)\b"
+)
+
+FORMATTER_MODES = ("auto", "template", "llm")
+
+
+def display_text(value: Any) -> str:
+    """Display text for a field, which may be a {"display_value": ..., "link": ...} reference"""
+    if isinstance(value, dict):
+        value = value.get("display_value") or value.get("value")
+    return "" if value is None else str(value).strip()
+
+
+def parse_date(value: Any) -> Optional[datetime]:
+    """Datetime for a ServiceNow date display value, or None if it isn't one"""
+    text = display_text(value)
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format)
+        except ValueError:
+            continue
+    return None
+
+
+def readable_date(value: Any) -> str:
+    """'2026-01-02 09:00:00' -> '02 Jan 2026, 09:00'; unrecognised values are returned as they are"""
+    text = display_text(value)
+    parsed = parse_date(text)
+    if parsed is None:
+        return text
+    return parsed.strftime("%d %b %Y") if len(text) <= 10 else parsed.strftime("%d %b %Y, %H:%M")
+
+
+def priority_rank(value: Any) -> int:
+    """1 for '1 - Critical', 99 when the priority is missing or unnumbered"""
+    match = re.match(r"\s*(\d+)", display_text(value))
+    return int(match.group(1)) if match else 99
+
+
+def _count(details: Dict) -> int:
+    try:
+        return int(details.get("count") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _plural(count: int, noun: str) -> str:
+    return f"{count} {noun}" if count == 1 else f"{count} {noun}s"
+
+
+class TemplateFormatter:
+    """Deterministic formatter for small or empty result sets, used in place of the LLM formatter when the policy allows"""
+
+    def __init__(self, mode: str = "auto", max_records: int = 10, max_related: int = 5):
+        if mode not in FORMATTER_MODES:
+            print(f"Unknown FORMATTER_MODE {mode}, using auto")
+            mode = "auto"
+        self.mode = mode
+        self.max_records = max_records
+        self.max_related = max_related
+
+    def choose(self, question: str, query_results: Dict) -> Tuple[str, str]:
+        """Pick "template" or "llm" for a result set, with the reason for the choice"""
+        if self.mode != "auto":
+            return self.mode, "mode"
+        if query_results.get("error"):
+            return "template", "error"
+        results = [result for result in query_results.get("results", []) if result.get("record_type") != "error"]
+        if not results:
+            return "template", "no_results"
+        if ANALYTICAL_PATTERN.search(question.lower()):
+            return "llm", "analytical_question"
+        records = sum(1 + len(result.get("related_incidents", [])) for result in results)
+        if records > self.max_records:
+            return "llm", "too_many_records"
+        return "template", "small_result_set"
+
+    def format(self, question: str, query_results: Dict) -> str:
+        """Render the response text for the process_query result structures"""
+        error = query_results.get("error")
+        if error and not query_results.get("partial"):
+            return f"I couldn't retrieve results from ServiceNow for your query: {error}"
+
+        results = query_results.get("results", [])
+        incidents = [result["incident_details"] for result in results if result.get("record_type") == "incident"]
+        problems = [result for result in results if result.get("record_type") == "problem"]
+        aggregates = [result["aggregate_details"] for result in results if result.get("record_type") == "aggregate"]
+
+        sections = []
+        if aggregates:
+            sections.append(self._format_aggregates(aggregates))
+        if problems:
+            sections.append(self._format_problems(problems))
+        if incidents:
+            sections.append(self._format_incidents(incidents))
+        if not sections:
+            return f"I didn't find any {self._record_noun(query_results)} matching your query."
+
+        summary = self._summary(incidents + [problem["problem_details"] for problem in problems])
+        if summary:
+            sections.append(summary)
+        if error:
+            sections.append(f"Some ServiceNow requests failed, so these results may be incomplete: {error}")
+        if query_results.get("truncated"):
+            sections.append("More records matched than the configured limit, so only the first ones are shown. Narrow your question to see the rest.")
+        return "\n\n".join(sections)
+
+    def _record_noun(self, query_results: Dict) -> str:
+        query_type = query_results.get("query_type")
+        if query_type == "problem":
+            return "problems"
+        if query_type == "combined":
+            return "incidents or problems"
+        if query_type == "aggregate":
+            return "records"
+        return "incidents"
+
+    def _priority(self, details: Dict) -> str:
+        """Priority text, in bold for priority 1 and 2"""
+        priority = display_text(details.get("priority"))
+        if not priority:
+            return ""
+        return f"**Priority {priority}**" if priority_rank(priority) <= 2 else f"Priority {priority}"
+
+    def _record_line(self, details: Dict) -> str:
+        """One bullet: number, state and priority, description, then owner and open date"""
+        status = ", ".join(part for part in (display_text(details.get("state")), self._priority(details)) if part)
+        line = f"- **{display_text(details.get('number')) or 'Unknown'}**"
+        if status:
+            line += f" ({status})"
+        description = display_text(details.get("description"))
+        if description:
+            line += f": {description}"
+
+        extras = []
+        assignee = display_text(details.get("assigned_to"))
+        group = display_text(details.get("assignment_group"))
+        if assignee and group:
+            extras.append(f"assigned to {assignee} ({group})")
+        elif assignee or group:
+            extras.append(f"assigned to {assignee or group}")
+        opened = readable_date(details.get("opened"))
+        if opened:
+            opened_by = display_text(details.get("opened_by"))
+            extras.append(f"opened {opened}" + (f" by {opened_by}" if opened_by else ""))
+        if extras:
+            text = "; ".join(extras)
+            line += f"\n  {text[0].upper()}{text[1:]}"
+        return line
+
+    def _format_incidents(self, incidents: List[Dict]) -> str:
+        ordered = sorted(incidents, key=lambda details: priority_rank(details.get("priority")))
+        lines = [f"I found {_plural(len(incidents), 'incident')}:"]
+        lines.extend(self._record_line(details) for details in ordered)
+        return "\n".join(lines)
+
+    def _format_problems(self, problems: List[Dict]) -> str:
+        ordered = sorted(problems, key=lambda result: priority_rank(result["problem_details"].get("priority")))
+        lines = [f"I found {_plural(len(problems), 'problem')}:"]
+        for result in ordered:
+            lines.append(self._record_line(result["problem_details"]))
+            related = result.get("related_incidents", [])
+            if related:
+                numbers = [display_text(incident.get("number")) for incident in related[:self.max_related]]
+                more = f" and {len(related) - self.max_related} more" if len(related) > self.max_related else ""
+                lines.append(f"  {_plural(len(related), 'related incident')}: {', '.join(numbers)}{more}")
+        return "\n".join(lines)
+
+    def _format_aggregates(self, aggregates: List[Dict]) -> str:
+        table = aggregates[0].get("table", "incident")
+        grouped = [details for details in aggregates if details.get("group_by")]
+        if not grouped:
+            details = aggregates[0]
+            text = f"I found {_plural(_count(details), table)} matching your query."
+            statistics = self._statistics(details)
+            return f"{text} {statistics.capitalize()}." if statistics else text
+
+        fields = ", ".join(field.replace("_", " ") for field in grouped[0]["group_by"])
+        ordered = sorted(grouped, key=lambda details: -_count(details))
+        total = sum(_count(details) for details in grouped)
+        lines = [f"{table.capitalize()} count by {fields} ({_plural(total, table)} in {_plural(len(grouped), 'group')}):"]
+        for details in ordered:
+            label = ", ".join(display_text(value) or "(empty)" for value in details["group_by"].values())
+            line = f"- {label}: {_count(details)}"
+            statistics = self._statistics(details)
+            if statistics:
+                line += f" ({statistics})"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def _statistics(self, details: Dict) -> str:
+        """'avg reassignment count 1.5, max reopen count 3' for the Aggregate API stats"""
+        parts = []
+        for stat in ("avg", "min", "max", "sum"):
+            for field, value in (details.get(stat) or {}).items():
+                parts.append(f"{stat} {field.replace('_', ' ')} {value}")
+        return ", ".join(parts)
+
+    def _summary(self, records: List[Dict]) -> str:
+        """Closing line on high-priority records and the most common state"""
+        if len(records) < 2:
+            return ""
+        urgent = sum(1 for details in records if priority_rank(details.get("priority")) <= 2)
+        states = {}
+        for details in records:
+            state = display_text(details.get("state"))
+            if state:
+                states[state] = states.get(state, 0) + 1
+        parts = []
+        if urgent:
+            parts.append(f"{urgent} of {len(records)} are priority 1 or 2")
+        if states:
+            state, count = max(states.items(), key=lambda item: item[1])
+            parts.append(f"most common state is {state} ({count} of {len(records)})")
+        return f"Summary: {'; '.join(parts)}." if parts else ""
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from concurrency import SingleFlight
+
+
+def test_followers_share_one_call():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"value": 1}
+
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(3)))
+        return calls, results, flight.stats()
+
+    calls, results, stats = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert [shared for _, shared in results] == [True, True, True]
+    assert results[0][0] == {"value": 1} and results[0][0] is not results[1][0]
+    assert stats == {"in_flight": 0, "executed": 1, "coalesced": 2}
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "done"
+
+        leader = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return calls, await follower
+
+    calls, result = asyncio.run(scenario())
+    assert calls == [1]
+    assert result == ("done", True)
+
+
+def test_work_is_cancelled_when_nobody_waits():
+    async def scenario():
+        flight = SingleFlight()
+        started = asyncio.Event()
+        cancelled = []
+
+        async def work():
+            started.set()
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+
+        leader = asyncio.create_task(flight.do("key", work))
+        await started.wait()
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        await asyncio.sleep(0)
+        return cancelled, flight.stats()
+
+    cancelled, stats = asyncio.run(scenario())
+    assert cancelled == [1]
+    assert stats["in_flight"] == 0
+
+
+def test_errors_reach_every_caller():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def work():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        return await asyncio.gather(*(flight.do("key", work) for _ in range(2)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
@@ -0,0 +1,96 @@
+import pytest
+
+from fast_parser import FastQueryParser
+
+
+@pytest.fixture
+def parser():
+    return FastQueryParser(min_confidence=0.9)
+
+
+def sysparm_query(result):
+    parsed_query, _ = result
+    return parsed_query[f"{parsed_query['query_type']}_query"]["sysparm_query"]
+
+
+def test_simple_filter(parser):
+    result = parser.parse("show me open P1 incidents")
+    assert result is not None
+    assert sysparm_query(result) == "priority=1^active=true"
+
+
+def test_combined_question_needs_llm(parser):
+    assert parser.parse("show problems and their incidents") is None
+
+
+@pytest.mark.parametrize("question", [
+    "show me all open incidents that are not high priority",
+    "show me all open incidents that are not in the network group",
+    "open incidents except the network group",
+    "open incidents excluding P1",
+    "incidents without an assignee",
+    "open incidents other than critical ones",
+    "non-critical open incidents",
+    "open incidents that aren't assigned",
+])
+def test_negation_needs_llm(parser, question):
+    assert parser.parse(question) is None
+
+
+def test_closed_window_uses_closed_at(parser):
+    assert sysparm_query(parser.parse("incidents closed in the last 7 days")) == "state=7^closed_at>=javascript:gs.daysAgoStart(7)"
+
+
+def test_resolved_yesterday_uses_resolved_at(parser):
+    assert sysparm_query(parser.parse("incidents resolved yesterday")) == (
+        "state=6^resolved_atONYesterday@javascript:gs.beginningOfYesterday()@javascript:gs.endOfYesterday()"
+    )
+
+
+def test_resolved_problems_window(parser):
+    assert sysparm_query(parser.parse("problems resolved in the last 2 months")) == "state=106^resolved_at>=javascript:gs.monthsAgoStart(2)"
+
+
+def test_explicit_opened_window_with_closed_state(parser):
+    assert sysparm_query(parser.parse("closed incidents opened in the last 7 days")) == "state=7^opened_at>=javascript:gs.daysAgoStart(7)"
+
+
+def test_window_without_state_uses_opened_at(parser):
+    assert sysparm_query(parser.parse("incidents opened in the last 3 days")).startswith("opened_at>=javascript:gs.daysAgoStart(3)")
+
+
+def test_window_on_state_without_date_field_needs_llm(parser):
+    assert parser.parse("cancelled incidents in the last week") is None
+
+
+def test_my_open_incidents_are_active(parser):
+    assert sysparm_query(parser.parse("show me my open incidents")) == "assigned_to=javascript:gs.getUserID()^active=true"
+
+
+def test_my_incidents_include_closed(parser):
+    assert sysparm_query(parser.parse("show me my incidents")) == "assigned_to=javascript:gs.getUserID()"
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("incidents for the new york team", "assignment_group.name=new york"),
+    ("open incidents for the high availability team", "active=true^assignment_group.name=high availability"),
+    ("incidents in the closed loop group", "assignment_group.name=closed loop"),
+    ("P1 incidents opened in the last 7 days for the Network team",
+     "priority=1^opened_at>=javascript:gs.daysAgoStart(7)^assignment_group.name=Network"),
+])
+def test_group_names_keep_priority_and_state_words(parser, question, expected):
+    assert sysparm_query(parser.parse(question)) == expected
+
+
+@pytest.mark.parametrize("question", [
+    "show me the high impact incidents for the service desk team",
+    "high urgency open incidents",
+    "critical severity incidents opened today",
+])
+def test_unsupported_fields_need_llm(parser, question):
+    assert parser.parse(question) is None
+
+
+def test_any_unknown_word_needs_llm_by_default():
+    assert FastQueryParser().parse("show me all open P1 incidents affecting payroll users") is None
+    assert FastQueryParser().parse("show me all open P1 incidents") is not None
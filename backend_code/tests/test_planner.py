@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+
+from planner import ExecutionPlan
+
+
+def test_independent_nodes_run_concurrently_and_dependents_get_inputs():
+    async def scenario():
+        order = []
+
+        def node(name, value):
+            async def run(inputs):
+                order.append(f"start {name}")
+                await asyncio.sleep(0.01)
+                order.append(f"end {name}")
+                return value + sum(inputs.values())
+            return run
+
+        plan = ExecutionPlan()
+        plan.add("problems", node("problems", 1)).add("incidents", node("incidents", 10))
+        plan.add("related", node("related", 100), depends_on=("problems",))
+        return plan.depth(), await plan.execute(), order
+
+    depth, outputs, order = asyncio.run(scenario())
+    assert depth == 2
+    assert outputs == {"problems": 1, "incidents": 10, "related": 101}
+    assert order[:2] == ["start problems", "start incidents"]
+    assert order.index("start related") > order.index("end problems")
+
+
+def test_unknown_dependency_is_rejected():
+    with pytest.raises(ValueError):
+        ExecutionPlan().add("related", None, depends_on=("problems",))
+
+
+def test_empty_plan_has_no_round_trips():
+    assert ExecutionPlan().depth() == 0
@@ -0,0 +1,74 @@
+import asyncio
+
+from replica import LocalReplica
+
+
+def make_record(sys_id, updated):
+    return {"sys_id": sys_id, "number": sys_id.upper(), "sys_updated_on": updated, "state": "1", "active": "true"}
+
+
+def source_pages(source, calls, on_call=None):
+    """iter_pages over a second replica standing in for the instance, one page per call"""
+    async def iter_pages(endpoint, params):
+        calls.append(params["sysparm_query"])
+        if on_call:
+            on_call(len(calls))
+        records = source.query("incident", params)
+        if records:
+            yield records
+    return iter_pages
+
+
+def test_sync_pages_by_timestamp_and_sys_id(tmp_path, monkeypatch):
+    monkeypatch.setenv("SERVICENOW_PAGE_SIZE", "2")
+    source = LocalReplica(str(tmp_path / "source.db"), max_staleness=60)
+    replica = LocalReplica(str(tmp_path / "replica.db"), max_staleness=60)
+    same_second = "2026-01-01 00:00:00"
+    source._upsert("incident", [make_record(sys_id, same_second) for sys_id in "abcde"])
+
+    def update_first_record(call):
+        # Updated after the first page is read, so it moves to the end of the order
+        if call == 2:
+            source._upsert("incident", [make_record("a", "2026-01-01 00:00:05")])
+
+    calls = []
+    synced = asyncio.run(replica.sync_table("incident", source_pages(source, calls, update_first_record)))
+
+    rows = replica.query("incident", {"sysparm_query": "ORDERBYsys_id", "sysparm_fields": "sys_id,sys_updated_on"})
+    assert [row["sys_id"] for row in rows] == list("abcde")
+    assert rows[0]["sys_updated_on"] == "2026-01-01 00:00:05"
+    assert synced == 6
+    assert calls[1] == (
+        "sys_updated_on>2026-01-01 00:00:00^NQsys_updated_on=2026-01-01 00:00:00^sys_id>b"
+        "^ORDERBYsys_updated_on^ORDERBYsys_id"
+    )
+    assert replica._sync_state("incident")[0] == "2026-01-01 00:00:05"
+
+
+def test_sync_resumes_from_watermark(tmp_path, monkeypatch):
+    monkeypatch.setenv("SERVICENOW_PAGE_SIZE", "10")
+    source = LocalReplica(str(tmp_path / "source.db"), max_staleness=60)
+    replica = LocalReplica(str(tmp_path / "replica.db"), max_staleness=60)
+    source._upsert("incident", [make_record("a", "2026-01-01 00:00:00"), make_record("b", "2026-01-01 00:00:01")])
+    asyncio.run(replica.sync_table("incident", source_pages(source, [])))
+
+    source._upsert("incident", [make_record("c", "2026-01-01 00:00:02")])
+    calls = []
+    synced = asyncio.run(replica.sync_table("incident", source_pages(source, calls)))
+    assert calls == ["sys_updated_on>=2026-01-01 00:00:01^ORDERBYsys_updated_on^ORDERBYsys_id"]
+    assert synced == 2
+    assert replica.stats()["incident_records"] == 3
+
+
+def test_stats_come_from_the_last_refresh(tmp_path):
+    replica = LocalReplica(str(tmp_path / "replica.db"), max_staleness=60)
+    assert replica.stats()["incident_records"] == 0
+    assert replica.stats()["incident_age_seconds"] is None
+
+    replica._upsert("incident", [make_record("a", "2026-01-01 00:00:00")])
+    replica._set_sync_state("incident", "2026-01-01 00:00:00", 1.0)
+    # stats() never touches the database, so it lags until the next refresh
+    assert replica.stats()["incident_records"] == 0
+    replica.refresh_stats("incident")
+    assert replica.stats()["incident_records"] == 1
+    assert replica.stats()["incident_age_seconds"] > 0
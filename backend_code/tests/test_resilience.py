@@ -0,0 +1,149 @@
+import asyncio
+import time
+from email.utils import formatdate
+
+import pytest
+
+from resilience import (
+    CircuitBreaker, CircuitOpenError, DeadlineExceeded, backoff_delay, hedged, parse_retry_after,
+    sleep_before_retry, start_deadline, with_timeout
+)
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    assert breaker.stats()["rejected"] == 1
+    assert breaker.stats()["times_opened"] == 1
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_half_open_lets_one_trial_through_and_closes_on_success():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == "open"
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    breaker.allow()
+    # Only the trial call goes through while it is outstanding
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.allow()
+
+
+def test_failed_trial_reopens_the_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.stats()["times_opened"] == 2
+
+
+def test_abandoned_trial_is_replaced_after_another_reset_timeout():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    breaker.allow()
+    time.sleep(0.06)
+    # The first trial never reported back (e.g. it was cancelled)
+    breaker.allow()
+
+
+def test_hedged_takes_the_first_success():
+    async def scenario():
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            # The first attempt is slow, the hedge is fast
+            await asyncio.sleep(0.2 if len(calls) == 1 else 0.01)
+            return len(calls)
+
+        started = time.monotonic()
+        result = await hedged(fn, 0.02)
+        return result, len(calls), time.monotonic() - started
+
+    result, calls, elapsed = asyncio.run(scenario())
+    assert calls == 2
+    assert result == 2
+    assert elapsed < 0.15
+
+
+def test_hedged_without_a_delay_makes_one_attempt():
+    async def scenario():
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "ok"
+
+        return await hedged(fn, None), len(calls)
+
+    assert asyncio.run(scenario()) == ("ok", 1)
+
+
+def test_hedged_raises_when_every_attempt_fails():
+    async def scenario():
+        async def fn():
+            await asyncio.sleep(0.02)
+            raise ValueError("down")
+
+        await hedged(fn, 0.01)
+
+    with pytest.raises(ValueError):
+        asyncio.run(scenario())
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("-1") == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(formatdate(time.time() + 30, usegmt=True)) == pytest.approx(30, abs=2)
+    assert parse_retry_after(formatdate(time.time() - 30, usegmt=True)) == 0.0
+
+
+def test_backoff_prefers_retry_after_and_is_capped(monkeypatch):
+    monkeypatch.setenv("SERVICENOW_RETRY_BASE_SECONDS", "1")
+    monkeypatch.setenv("SERVICENOW_RETRY_MAX_SECONDS", "2")
+    assert backoff_delay(5, retry_after=7.0) == 7.0
+    assert all(0 <= backoff_delay(10) <= 2 for _ in range(50))
+
+
+def test_retry_wait_beyond_the_deadline_gives_up():
+    async def scenario():
+        start_deadline(0.05)
+        await sleep_before_retry(0, retry_after=1.0)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(scenario())
+
+
+def test_with_timeout_is_capped_by_the_deadline():
+    async def scenario():
+        start_deadline(0.05)
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            await with_timeout(asyncio.sleep(1), 10, "ServiceNow call")
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) < 0.5
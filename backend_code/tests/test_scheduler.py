@@ -0,0 +1,150 @@
+import asyncio
+
+import pytest
+
+from resilience import DeadlineExceeded, start_deadline
+from scheduler import Overloaded, ResourceScheduler, set_priority_class
+
+
+async def hold(scheduler, priority_class, admitted, release=None, name=None):
+    """Take a slot in a priority class, note the admission, then hold the slot until release is set"""
+    set_priority_class(priority_class)
+    async with scheduler.slot():
+        admitted.append(name or priority_class)
+        if release is not None:
+            await release.wait()
+
+
+def test_queue_is_served_by_priority_class_then_arrival():
+    async def scenario():
+        scheduler = ResourceScheduler("servicenow", max_concurrency=1, max_queue=10)
+        admitted = []
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(scheduler, "interactive", admitted, release, "holder"))
+        await asyncio.sleep(0)
+        waiters = [
+            asyncio.create_task(hold(scheduler, priority_class, admitted, name=name))
+            for priority_class, name in [("export", "export"), ("batch", "batch 1"), ("interactive", "interactive"), ("batch", "batch 2")]
+        ]
+        await asyncio.sleep(0)
+        queued = scheduler.stats()["queued"]
+        release.set()
+        await asyncio.gather(holder, *waiters)
+        return admitted, queued, scheduler.stats()
+
+    admitted, queued, stats = asyncio.run(scenario())
+    assert queued == 4
+    assert admitted == ["holder", "interactive", "batch 1", "batch 2", "export"]
+    assert stats["running"] == 0 and stats["queued"] == 0
+
+
+def test_lower_classes_are_shed_first_as_the_queue_fills():
+    async def scenario():
+        scheduler = ResourceScheduler("llm", max_concurrency=1, max_queue=4)
+        release = asyncio.Event()
+        admitted = []
+        tasks = [asyncio.create_task(hold(scheduler, "interactive", admitted, release))]
+        await asyncio.sleep(0)
+        outcomes = {}
+        # Export may fill a quarter of the queue (1), batch half (2), interactive all of it (4)
+        for priority_class in ["export", "export", "batch", "batch", "interactive", "interactive", "interactive"]:
+            task = asyncio.create_task(hold(scheduler, priority_class, admitted))
+            await asyncio.sleep(0)
+            tasks.append(task)
+        release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for priority_class, result in zip(["holder", "export", "export", "batch", "batch", "interactive", "interactive", "interactive"], results):
+            outcomes.setdefault(priority_class, []).append("shed" if isinstance(result, Overloaded) else "ok")
+        return outcomes, results, scheduler.stats()
+
+    outcomes, results, stats = asyncio.run(scenario())
+    assert outcomes == {
+        "holder": ["ok"],
+        "export": ["ok", "shed"],
+        "batch": ["ok", "shed"],
+        "interactive": ["ok", "ok", "shed"]
+    }
+    shed = next(result for result in results if isinstance(result, Overloaded))
+    assert shed.status_code == 503
+    assert int(shed.headers["Retry-After"]) >= 1
+    assert (stats["shed_export"], stats["shed_batch"], stats["shed_interactive"]) == (1, 1, 1)
+
+
+def test_expected_wait_beyond_the_deadline_is_shed():
+    async def scenario():
+        scheduler = ResourceScheduler("servicenow", max_concurrency=1, max_queue=10)
+        scheduler.average_hold_seconds = 1.0
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(scheduler, "interactive", [], release))
+        await asyncio.sleep(0)
+
+        async def short_budget():
+            start_deadline(0.2)
+            await hold(scheduler, "interactive", [])
+
+        async def spent_budget():
+            start_deadline(0)
+            await hold(scheduler, "interactive", [])
+
+        outcomes = await asyncio.gather(short_budget(), spent_budget(), return_exceptions=True)
+        release.set()
+        await holder
+        return outcomes
+
+    short, spent = asyncio.run(scenario())
+    assert isinstance(short, Overloaded)
+    assert isinstance(spent, DeadlineExceeded)
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        scheduler = ResourceScheduler("servicenow", max_concurrency=1, max_queue=10)
+        release = asyncio.Event()
+        admitted = []
+        holder = asyncio.create_task(hold(scheduler, "interactive", admitted, release, "holder"))
+        await asyncio.sleep(0)
+        cancelled = asyncio.create_task(hold(scheduler, "interactive", admitted, name="cancelled"))
+        waiter = asyncio.create_task(hold(scheduler, "interactive", admitted, name="waiter"))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        queued = scheduler.stats()["queued"]
+        release.set()
+        await asyncio.gather(holder, waiter)
+        return admitted, queued, cancelled.cancelled(), scheduler.stats()
+
+    admitted, queued, was_cancelled, stats = asyncio.run(scenario())
+    assert was_cancelled
+    assert queued == 1
+    assert admitted == ["holder", "waiter"]
+    assert stats["running"] == 0
+
+
+def test_slot_handed_to_a_cancelled_waiter_is_passed_on():
+    async def scenario():
+        scheduler = ResourceScheduler("servicenow", max_concurrency=1, max_queue=10)
+        release = asyncio.Event()
+        admitted = []
+        holder = asyncio.create_task(hold(scheduler, "interactive", admitted, release, "holder"))
+        await asyncio.sleep(0)
+        first = asyncio.create_task(hold(scheduler, "interactive", admitted, name="first"))
+        second = asyncio.create_task(hold(scheduler, "interactive", admitted, name="second"))
+        await asyncio.sleep(0)
+        release.set()
+        # Let the holder release (handing its slot to first), then cancel first before it runs
+        while not holder.done():
+            await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.gather(second, return_exceptions=True)
+        await asyncio.gather(first, return_exceptions=True)
+        return admitted, first.cancelled(), scheduler.stats()
+
+    admitted, first_cancelled, stats = asyncio.run(scenario())
+    assert first_cancelled
+    assert admitted == ["holder", "second"]
+    assert stats["running"] == 0 and stats["queued"] == 0
+
+
+def test_unknown_priority_class_is_rejected():
+    with pytest.raises(ValueError):
+        set_priority_class("bulk")
@@ -0,0 +1,17 @@
+import serializer
+
+
+def test_count_tokens_estimates_until_the_encoding_is_loaded(monkeypatch):
+    monkeypatch.setattr(serializer, "_encoding", None)
+    assert serializer.count_tokens("x" * 40) == 10
+    # Counting never loads the encoding itself; only load_token_encoding does
+    assert serializer._encoding is None
+
+
+def test_count_tokens_uses_the_loaded_encoding(monkeypatch):
+    class Encoding:
+        def encode(self, text):
+            return text.split()
+
+    monkeypatch.setattr(serializer, "_encoding", Encoding())
+    assert serializer.count_tokens("three short words") == 3
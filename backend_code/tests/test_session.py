@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from session import RefinementParser, SessionStore, apply_refinement, project_results
+from shared_state import LocalStateBackend
+
+
+@pytest.fixture
+def parser():
+    return RefinementParser(min_confidence=0.9)
+
+
+def incident(number, priority, state="In Progress", group="Network", opened="2026-01-02 09:00:00", assigned_to="Ann"):
+    return {
+        "record_type": "incident",
+        "incident_details": {
+            "number": number,
+            "priority": priority,
+            "state": state,
+            "assignment_group": group,
+            "opened": opened,
+            "assigned_to": assigned_to,
+            "description": f"Issue {number}"
+        }
+    }
+
+
+@pytest.mark.parametrize("question", [
+    "show me open incidents for the network team and sort them by priority",
+    "list the new incidents and show them sorted by date",
+    "show me high priority incidents and who is assigned to them",
+    "show me the P1 problems and the incidents related to them",
+])
+def test_new_questions_with_a_reference_word_are_not_refinements(parser, question):
+    assert parser.parse(question) is None
+
+
+def test_question_without_a_reference_is_not_a_refinement(parser):
+    assert parser.parse("only the P1s") is None
+
+
+def test_priority_filter(parser):
+    refinement = parser.parse("which of those are P1")
+    assert refinement["filters"] == [{"field": "priority", "in": [1]}]
+
+
+def test_sort_and_limit(parser):
+    refinement = parser.parse("keep the top 3 of those newest first")
+    assert refinement["sort"] == {"field": "opened", "descending": True}
+    assert refinement["limit"] == 3
+
+
+def test_referred_table_noun_is_allowed(parser):
+    refinement = parser.parse("which of those incidents are in the Network group")
+    assert refinement["filters"] == [{"field": "assignment_group", "contains": "network"}]
+
+
+def test_projection(parser):
+    assert parser.parse("show only the numbers and descriptions of those")["fields"] == ["number", "description"]
+
+
+def test_apply_refinement_filters_sorts_and_limits():
+    results = [
+        incident("INC1", "3 - Moderate"),
+        incident("INC2", "1 - Critical", group="Database"),
+        incident("INC3", "1 - Critical"),
+        incident("INC4", "2 - High", state="Closed")
+    ]
+    refinement = {
+        "filters": [{"field": "state", "active": True}, {"field": "assignment_group", "contains": "net"}],
+        "sort": {"field": "priority", "descending": False},
+        "limit": 1
+    }
+    assert [result["incident_details"]["number"] for result in apply_refinement(results, refinement)] == ["INC3"]
+
+
+def test_project_results_keeps_the_number():
+    projected = project_results([incident("INC1", "1 - Critical")], ["priority"])
+    assert projected[0]["incident_details"] == {"number": "INC1", "priority": "1 - Critical"}
+
+
+def test_session_store_keeps_small_result_sets_only():
+    async def scenario():
+        store = SessionStore(LocalStateBackend(), max_sessions=10, ttl=60, max_bytes=1_000_000, max_records=2)
+        await store.save("small", "q", {"query_type": "incident"}, {"query_type": "incident", "results": [incident("INC1", "1")]})
+        await store.save("large", "q", {"query_type": "incident"}, {"query_type": "incident", "results": [incident(f"INC{i}", "1") for i in range(3)]})
+        small = await store.get("small")
+        small["results"].clear()
+        return small, await store.get("small"), await store.get("large")
+
+    mutated, small, large = asyncio.run(scenario())
+    assert len(small["results"]) == 1
+    assert large["results"] is None
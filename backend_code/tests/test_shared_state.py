@@ -0,0 +1,132 @@
+import asyncio
+import time
+
+import pytest
+
+from shared_state import LocalStateBackend, LockTimeout, RateLimiter, SQLiteStateBackend
+
+
+@pytest.fixture(params=["local", "sqlite"])
+def backend(request, tmp_path):
+    backend = LocalStateBackend() if request.param == "local" else SQLiteStateBackend(str(tmp_path / "state.db"))
+    yield backend
+    backend.close()
+
+
+def test_token_bucket_allows_a_burst_then_reports_the_wait(backend):
+    async def scenario():
+        return [await backend.take_token("servicenow", rate=10, burst=2) for _ in range(3)]
+
+    first, second, third = asyncio.run(scenario())
+    assert first == 0 and second == 0
+    assert third == pytest.approx(0.1, abs=0.02)
+
+
+def test_token_bucket_charges_the_call_cost(backend):
+    async def scenario():
+        return [await backend.take_token("llm", rate=2, burst=4, cost=3) for _ in range(2)]
+
+    first, second = asyncio.run(scenario())
+    assert first == 0
+    # One token left, two more needed at two per second
+    assert second == pytest.approx(1.0, abs=0.02)
+
+
+def test_token_bucket_refills_over_time(backend):
+    async def scenario():
+        await backend.take_token("servicenow", rate=20, burst=1)
+        await asyncio.sleep(0.06)
+        return await backend.take_token("servicenow", rate=20, burst=1)
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_rate_limiter_waits_or_gives_up_within_the_budget(backend):
+    async def scenario():
+        limiter = RateLimiter(backend, "servicenow", rate=20, burst=1)
+        await limiter.acquire()
+        started = time.monotonic()
+        await limiter.acquire(max_wait=1.0)
+        waited = time.monotonic() - started
+        with pytest.raises(TimeoutError):
+            await limiter.acquire(max_wait=0.001)
+        return waited, limiter.stats()
+
+    waited, stats = asyncio.run(scenario())
+    assert waited >= 0.04
+    assert stats["waits"] == 1
+
+
+def test_sqlite_bucket_is_shared_between_workers(tmp_path):
+    path = str(tmp_path / "state.db")
+    first, second = SQLiteStateBackend(path), SQLiteStateBackend(path)
+
+    async def scenario():
+        return await first.take_token("servicenow", rate=1, burst=1), await second.take_token("servicenow", rate=1, burst=1)
+
+    try:
+        taken, wait = asyncio.run(scenario())
+    finally:
+        first.close()
+        second.close()
+    assert taken == 0
+    assert wait == pytest.approx(1.0, abs=0.02)
+
+
+def test_lock_times_out_while_held(backend):
+    async def scenario():
+        async with backend.lock("replica_sync", timeout=0):
+            with pytest.raises(LockTimeout):
+                async with backend.lock("replica_sync", timeout=0):
+                    pass
+            with pytest.raises(LockTimeout):
+                async with backend.lock("replica_sync", timeout=0.1):
+                    pass
+        # Released on exit
+        async with backend.lock("replica_sync", timeout=0):
+            return True
+
+    assert asyncio.run(scenario())
+
+
+def test_sqlite_lock_excludes_other_workers_until_it_expires(tmp_path):
+    path = str(tmp_path / "state.db")
+    first, second = SQLiteStateBackend(path), SQLiteStateBackend(path)
+
+    async def scenario():
+        held = first.lock("token_refresh", timeout=0, ttl=0.2)
+        await held.__aenter__()
+        with pytest.raises(LockTimeout):
+            async with second.lock("token_refresh", timeout=0):
+                pass
+        # A worker that died holding the lock loses it after ttl
+        await asyncio.sleep(0.25)
+        async with second.lock("token_refresh", timeout=0):
+            pass
+        await held.__aexit__(None, None, None)
+        return True
+
+    try:
+        assert asyncio.run(scenario())
+    finally:
+        first.close()
+        second.close()
+
+
+def test_sqlite_values_are_shared_and_expire(tmp_path):
+    path = str(tmp_path / "state.db")
+    first, second = SQLiteStateBackend(path), SQLiteStateBackend(path)
+
+    async def scenario():
+        await first.set("result", "key", {"results": [1]}, ttl=0.2)
+        shared = await second.get("result", "key")
+        await asyncio.sleep(0.25)
+        return shared, await second.get("result", "key")
+
+    try:
+        shared, expired = asyncio.run(scenario())
+    finally:
+        first.close()
+        second.close()
+    assert shared == {"results": [1]}
+    assert expired is None
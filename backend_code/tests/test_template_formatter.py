@@ -0,0 +1,32 @@
+from template_formatter import TemplateFormatter
+
+
+def incident(number, priority="1 - Critical"):
+    return {"record_type": "incident", "incident_details": {"number": number, "priority": priority, "state": "New"}}
+
+
+def test_no_results():
+    text = TemplateFormatter().format("open P1 incidents", {"query_type": "incident", "results": []})
+    assert text == "I didn't find any incidents matching your query."
+
+
+def test_failed_fetch_is_not_reported_as_no_results():
+    formatter = TemplateFormatter()
+    query_results = {"query_type": "incident", "results": [], "error": "503 Service Unavailable", "partial": False}
+    assert formatter.choose("open P1 incidents", query_results) == ("template", "error")
+    assert formatter.format("open P1 incidents", query_results) == (
+        "I couldn't retrieve results from ServiceNow for your query: 503 Service Unavailable"
+    )
+
+
+def test_partial_results_carry_a_warning():
+    query_results = {"query_type": "combined", "results": [incident("INC1")], "error": "circuit open", "partial": True}
+    text = TemplateFormatter().format("problems and their incidents", query_results)
+    assert text.startswith("I found 1 incident:\n- **INC1**")
+    assert text.endswith("Some ServiceNow requests failed, so these results may be incomplete: circuit open")
+
+
+def test_truncated_results_say_so():
+    query_results = {"query_type": "incident", "results": [incident("INC1")], "truncated": True}
+    text = TemplateFormatter().format("open P1 incidents", query_results)
+    assert text.endswith("only the first ones are shown. Narrow your question to see the rest.")